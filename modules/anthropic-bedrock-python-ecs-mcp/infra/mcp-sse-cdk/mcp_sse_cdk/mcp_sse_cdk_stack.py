@@ -196,7 +196,10 @@ class McpSseCdkStack(Stack):
             ),
             logging=ecs.LogDriver.aws_logs(stream_prefix="ecs", log_group=log_group),
             port_mappings=[ecs.PortMapping(name="http", container_port=8080, app_protocol=ecs.AppProtocol.http)],
-            environment={"SERVER_URL": f"http://mcp-server.{namespace.namespace_name}:8000"},
+            environment={
+                "SERVER_URL": f"http://mcp-server.{namespace.namespace_name}:8000",
+                "MAX_CONCURRENT_QUERIES": "16",
+            },
         )
 
         server_service = ecs.FargateService(
@@ -246,6 +249,9 @@ class McpSseCdkStack(Stack):
             internet_facing=True,
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
             security_group=alb_security_group,
+            # /query can take up to the client's QUERY_TIMEOUT (120s) without
+            # sending a byte; /query/stream sends keepalives every 15s
+            idle_timeout=Duration.seconds(180),
         )
 
         # Target Group
@@ -1,18 +1,38 @@
-from typing import Optional
-from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import json
+import time
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
-from mcp import ClientSession
-from mcp.client.sse import sse_client
+from mcp_session_pool import MCPSessionPool
 
-from anthropic import AnthropicBedrock
+from anthropic import AsyncAnthropicBedrock
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 SERVER_URL = os.getenv("SERVER_URL", "http://0.0.0.0:8080")
+MODEL_ID = os.getenv("MODEL_ID", "us.anthropic.claude-3-5-sonnet-20241022-v2:0")
+# Queries processed at once; further requests wait for a free slot
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "16"))
+# Seconds before the cached tool list is fetched again, in case a
+# tools/list_changed notification was missed; 0 disables expiry
+TOOLS_CACHE_TTL = float(os.getenv("TOOLS_CACHE_TTL", "300"))
+# SSE sessions to the MCP server; concurrent tool calls are spread over them
+MCP_SESSION_POOL_SIZE = int(os.getenv("MCP_SESSION_POOL_SIZE", "4"))
+# Seconds between pings of each session; dead sessions are reconnected
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "15"))
+MAX_TOKENS = 1000
+# Rounds of tool calls per query; tools requested after the last round are not run
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "10"))
+# Seconds a query may take, model and tool calls included
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "120"))
+# Seconds between SSE comments sent by /query/stream while nothing else is,
+# so the load balancer and proxies do not close an idle connection
+STREAM_KEEPALIVE_INTERVAL = float(os.getenv("STREAM_KEEPALIVE_INTERVAL", "15"))
 app = FastAPI()
 
 
@@ -20,83 +40,285 @@ class Query(BaseModel):
     text: str
 
 
-class MCPClient:
-    def __init__(self):
-        self.session: Optional[ClientSession] = None
-        self.exit_stack = AsyncExitStack()
-        self.anthropic = AnthropicBedrock()
+# Receives progress of a query: on_event(event, data)
+EventCallback = Callable[[str, Dict[str, Any]], None]
 
-    async def connect_to_sse_server(self, server_url: str):
-        """Connect to an MCP server running with SSE transport"""
-        self._streams_context = sse_client(url=f"{server_url}/sse")
-        streams = await self._streams_context.__aenter__()
 
-        self._session_context = ClientSession(*streams)
-        self.session: ClientSession = await self._session_context.__aenter__()
+class MCPClient:
+    def __init__(
+        self,
+        max_concurrent_queries: int = MAX_CONCURRENT_QUERIES,
+        tools_cache_ttl: float = TOOLS_CACHE_TTL,
+        pool_size: int = MCP_SESSION_POOL_SIZE,
+    ):
+        self.pool_size = pool_size
+        self.pool: Optional[MCPSessionPool] = None
+        # The async client awaits Bedrock instead of blocking the event loop,
+        # so one slow completion does not hold up the other requests
+        self.anthropic = AsyncAnthropicBedrock()
+        self.query_slots = asyncio.Semaphore(max_concurrent_queries)
+        self.tools_cache_ttl = tools_cache_ttl
+        self._tools: Optional[List[Dict[str, Any]]] = None  # Anthropic-format tool list
+        self._tools_fetched_at = 0.0
+        self._tools_refresh: Optional[asyncio.Task] = None  # In-flight list_tools request
+        self._tools_version = 0  # Bumped by tools/list_changed
 
-        await self.session.initialize()
+    async def connect_to_sse_server(self, server_url: str):
+        """Connect a pool of sessions to an MCP server running with SSE transport"""
+        self.pool = MCPSessionPool(
+            server_url,
+            size=self.pool_size,
+            message_handler=self._handle_message,
+            health_check_interval=MCP_HEALTH_CHECK_INTERVAL,
+        )
+        await self.pool.start()
 
-        print("Initialized SSE client...")
+        healthy = sum(session.healthy for session in self.pool.sessions)
+        print(f"Initialized SSE client with {healthy}/{self.pool_size} sessions...")
         print("Listing tools...")
-        response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
-
-    async def cleanup(self):
-        """Properly clean up the session and streams"""
-        if self._session_context:
-            await self._session_context.__aexit__(None, None, None)
-        if self._streams_context:
-            await self._streams_context.__aexit__(None, None, None)
-
-    async def process_query(self, query: str) -> str:
-        """Process a query using Claude and available tools"""
-        messages = [{"role": "user", "content": query}]
-
-        response = await self.session.list_tools()
-        available_tools = [
+        tools = await self.refresh_tools()
+        print("\nConnected to server with tools:", [tool["name"] for tool in tools])
+
+    async def _handle_message(self, message):
+        """Drop the cached tool list when the server reports that its tools changed"""
+        if isinstance(message, Exception):
+            print(f"Error in message handling: {message}")
+            return
+        method = getattr(getattr(message, "root", None), "method", None)
+        if method == "notifications/tools/list_changed":
+            print("Server tools changed, refreshing on next query")
+            self._tools = None
+            self._tools_version += 1
+
+    async def get_tools(self) -> List[Dict[str, Any]]:
+        """
+        The server's tools in Anthropic format. They are listed once and then
+        reused until a tools/list_changed notification or the TTL expires.
+        """
+        expired = (
+            self.tools_cache_ttl > 0
+            and time.monotonic() - self._tools_fetched_at > self.tools_cache_ttl
+        )
+        if self._tools is None or expired:
+            return await self.refresh_tools()
+        return self._tools
+
+    async def refresh_tools(self) -> List[Dict[str, Any]]:
+        """List the server's tools, sharing one request between concurrent callers"""
+        if self._tools_refresh is None:
+            self._tools_refresh = asyncio.create_task(self._list_tools())
+            self._tools_refresh.add_done_callback(self._clear_tools_refresh)
+        return await asyncio.shield(self._tools_refresh)
+
+    def _clear_tools_refresh(self, task):
+        if self._tools_refresh is task:
+            self._tools_refresh = None
+
+    async def _list_tools(self) -> List[Dict[str, Any]]:
+        version = self._tools_version
+        tools = await self.pool.list_tools()
+        formatted_tools = [
             {
                 "name": tool.name,
                 "description": tool.description,
                 "input_schema": tool.inputSchema,
             }
-            for tool in response.tools
+            for tool in tools
         ]
+        # A list fetched before a tools/list_changed notification may be stale
+        if version == self._tools_version:
+            self._tools = formatted_tools
+            self._tools_fetched_at = time.monotonic()
+        return formatted_tools
 
-        response = self.anthropic.messages.create(
-            model="us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-            max_tokens=1000,
-            messages=messages,
-            tools=available_tools,
-        )
+    async def cleanup(self):
+        """Properly clean up the sessions and streams"""
+        if self._tools_refresh:
+            self._tools_refresh.cancel()
+        if self.pool:
+            await self.pool.close()
+        await self.anthropic.close()
+
+    async def process_query(self, query: str, on_event: Optional[EventCallback] = None) -> Dict[str, Any]:
+        """Process a query, waiting while MAX_CONCURRENT_QUERIES others are running"""
+        async with self.query_slots:
+            return await self._process_query(query, on_event)
+
+    async def stream_query(self, query: str) -> AsyncIterator[str]:
+        """
+        Process a query, yielding server-sent events as it progresses: text
+        deltas, tool calls and results, then done with the same body /query
+        returns, or error. Comment lines are sent while waiting.
+        """
+        events = asyncio.Queue()
+
+        async def run():
+            try:
+                result = await self.process_query(
+                    query, on_event=lambda event, data: events.put_nowait((event, data))
+                )
+                events.put_nowait(("done", result))
+            except Exception as e:
+                events.put_nowait(("error", {"detail": str(e)}))
+
+        # The query runs in its own task, so that its timeouts are not
+        # affected by the time spent sending events
+        task = asyncio.create_task(run())
+        try:
+            # Sent right away, even while waiting for a free query slot
+            yield ": started\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), STREAM_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+                if event in ("done", "error"):
+                    break
+        finally:
+            # Stop working on the query if the client went away
+            task.cancel()
+
+    async def _process_query(self, query: str, on_event: Optional[EventCallback] = None) -> Dict[str, Any]:
+        """
+        Process a query using Claude and available tools. Each round sends the
+        conversation to the model and runs the tools it asked for concurrently,
+        until it answers without tools, after MAX_TOOL_ROUNDS rounds of tool
+        calls, or when QUERY_TIMEOUT seconds have passed. on_event(event, data),
+        if given, is called with text deltas and tool progress.
+        """
+        started = time.monotonic()
+        deadline = started + QUERY_TIMEOUT
+        messages = [{"role": "user", "content": query}]
+        available_tools = await self.get_tools()
 
-        tool_results = []
         final_text = []
-
-        for content in response.content:
-            if content.type == "text":
-                final_text.append(content.text)
-            elif content.type == "tool_use":
-                tool_name = content.name
-                tool_args = content.input
-
-                result = await self.session.call_tool(tool_name, tool_args)
-                tool_results.append({"call": tool_name, "result": result})
-                final_text.append(f"[Calling tool {tool_name} with args {tool_args}]")
-
-                if hasattr(content, "text") and content.text:
-                    messages.append({"role": "assistant", "content": content.text})
-                messages.append({"role": "user", "content": result.content})
-
-                response = self.anthropic.messages.create(
-                    model="us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-                    max_tokens=1000,
-                    messages=messages,
+        rounds = []
+        stop_reason = None
+        while stop_reason is None:
+            round_timing = {"round": len(rounds) + 1}
+            rounds.append(round_timing)
+            round_started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    self._create_message(messages, available_tools, on_event),
+                    timeout=max(0.0, deadline - round_started),
+                )
+            except asyncio.TimeoutError:
+                stop_reason = "deadline"
+                break
+            finally:
+                round_timing["model_ms"] = elapsed_ms(round_started)
+
+            messages.append({"role": "assistant", "content": response.content})
+            tool_uses = [content for content in response.content if content.type == "tool_use"]
+            if response.stop_reason != "tool_use" or not tool_uses:
+                stop_reason = response.stop_reason
+            elif len(rounds) > MAX_TOOL_ROUNDS:
+                stop_reason = "max_tool_rounds"
+
+            for content in response.content:
+                if content.type == "text":
+                    final_text.append(content.text)
+                elif content.type == "tool_use" and stop_reason is None:
+                    # Only tools that are actually run are reported
+                    final_text.append(f"[Calling tool {content.name} with args {content.input}]")
+
+            if stop_reason is None:
+                tools_started = time.monotonic()
+                tool_results = await asyncio.gather(
+                    *(self._call_tool(tool_use, deadline, on_event) for tool_use in tool_uses)
+                )
+                round_timing["tools_ms"] = elapsed_ms(tools_started)
+                round_timing["tool_calls"] = [timing for _, timing in tool_results]
+                # All results of a round go back in one user message, each
+                # paired with its tool_use block by ID
+                messages.append(
+                    {"role": "user", "content": [result for result, _ in tool_results]}
                 )
 
-                final_text.append(response.content[0].text)
-
-        return "\n".join(final_text)
+        if stop_reason == "max_tool_rounds":
+            skipped = ", ".join(tool_use.name for tool_use in tool_uses)
+            final_text.append(
+                f"[Stopped: tool round limit ({MAX_TOOL_ROUNDS}) reached, not calling {skipped}]"
+            )
+        elif stop_reason == "deadline":
+            final_text.append(f"[Stopped after the {QUERY_TIMEOUT:g}s query timeout]")
+        return {
+            "response": "\n".join(final_text),
+            "stop_reason": stop_reason,
+            "total_ms": elapsed_ms(started),
+            "rounds": rounds,
+        }
+
+    async def _create_message(self, messages, tools, on_event: Optional[EventCallback]):
+        """Call the model, streaming its text to on_event if given"""
+        if on_event is None:
+            return await self.anthropic.messages.create(
+                model=MODEL_ID, max_tokens=MAX_TOKENS, messages=messages, tools=tools
+            )
+        async with self.anthropic.messages.stream(
+            model=MODEL_ID, max_tokens=MAX_TOKENS, messages=messages, tools=tools
+        ) as stream:
+            async for event in stream:
+                if event.type == "text":
+                    on_event("text", {"text": event.text})
+            return await stream.get_final_message()
+
+    async def _call_tool(self, tool_use, deadline: float, on_event: Optional[EventCallback] = None):
+        """Run one tool_use block; returns its tool_result block and timing"""
+        if on_event:
+            on_event("tool_call", {"id": tool_use.id, "name": tool_use.name, "input": tool_use.input})
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                self.pool.call_tool(tool_use.name, tool_use.input),
+                timeout=max(0.0, deadline - started),
+            )
+            content = to_tool_result_content(result.content)
+            is_error = bool(result.isError)
+        except asyncio.TimeoutError:
+            content = [{"type": "text", "text": "Error: the tool call timed out"}]
+            is_error = True
+        except Exception as e:
+            content = [{"type": "text", "text": f"Error: {e}"}]
+            is_error = True
+        tool_result = {
+            "type": "tool_result",
+            "tool_use_id": tool_use.id,
+            "content": content,
+            "is_error": is_error,
+        }
+        timing = {"name": tool_use.name, "ms": elapsed_ms(started), "is_error": is_error}
+        if on_event:
+            on_event("tool_result", {"id": tool_use.id, **timing})
+        return tool_result, timing
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def to_tool_result_content(content: List[Any]) -> List[Dict[str, Any]]:
+    """Convert MCP tool result content to tool_result content blocks"""
+    blocks = []
+    for item in content:
+        if item.type == "text":
+            blocks.append({"type": "text", "text": item.text})
+        elif item.type == "image":
+            blocks.append(
+                {
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": item.mimeType, "data": item.data},
+                }
+            )
+        elif item.type == "resource" and hasattr(item.resource, "text"):
+            blocks.append({"type": "text", "text": item.resource.text})
+        else:
+            blocks.append({"type": "text", "text": item.model_dump_json()})
+    # An empty text block is rejected; an empty result is represented by no content
+    return [block for block in blocks if block["type"] != "text" or block["text"]]
 
 
 # Create a global MCPClient instance
@@ -119,16 +341,29 @@ async def shutdown_event():
 async def process_query(query: Query):
     """Handle POST requests with queries"""
     try:
-        response = await mcp_client.process_query(query.text)
-        return {"response": response}
+        return await mcp_client.process_query(query.text)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/stream")
+async def stream_query(query: Query):
+    """Handle POST requests with queries, streaming progress as server-sent events"""
+    return StreamingResponse(
+        mcp_client.stream_query(query.text),
+        media_type="text/event-stream",
+        # Ask proxies not to buffer or cache the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "mcp_sessions": mcp_client.pool.stats() if mcp_client.pool else {},
+    }
 
 
 if __name__ == "__main__":
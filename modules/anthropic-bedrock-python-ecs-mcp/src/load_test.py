@@ -0,0 +1,126 @@
+"""
+Load test for the client's /query endpoint.
+
+Sends the same query at increasing concurrency levels and reports throughput
+and latency percentiles for each level. With non-blocking Bedrock calls,
+throughput should grow with concurrency until MAX_CONCURRENT_QUERIES (or the
+Bedrock quota) is reached, while latency stays roughly flat:
+
+    uv run load_test.py --url http://${ALB_DNS} --concurrency 1 4 16 --requests 32
+
+With --stream, queries go to /query/stream and the time to the first event
+(e.g. the first text delta) is reported as well.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def send_query(client: httpx.AsyncClient, url: str, text: str) -> float:
+    """Send one query and return its latency in seconds"""
+    started = time.perf_counter()
+    response = await client.post(f"{url}/query", json={"text": text})
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def stream_query(client: httpx.AsyncClient, url: str, text: str):
+    """Send one query to /query/stream; returns the seconds to the first event and to the end"""
+    started = time.perf_counter()
+    first_event = None
+    async with client.stream("POST", f"{url}/query/stream", json={"text": text}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                if line == "event: error":
+                    raise httpx.HTTPError("Query failed: see the error event")
+    return first_event, time.perf_counter() - started
+
+
+async def run_level(url: str, text: str, concurrency: int, requests: int, timeout: float,
+                    stream: bool = False) -> dict:
+    """Send `requests` queries with at most `concurrency` in flight"""
+    latencies = []
+    first_events = []
+    errors = []
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            async with slots:
+                try:
+                    if stream:
+                        first_event, latency = await stream_query(client, url, text)
+                        first_events.append(first_event)
+                        latencies.append(latency)
+                    else:
+                        latencies.append(await send_query(client, url, text))
+                except httpx.HTTPError as e:
+                    errors.append(str(e) or type(e).__name__)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+    }
+    if latencies:
+        latencies.sort()
+        result["p50"] = statistics.median(latencies)
+        result["p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        result["max"] = latencies[-1]
+    first_events = [seconds for seconds in first_events if seconds is not None]
+    if first_events:
+        result["first_event_p50"] = statistics.median(first_events)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def print_result(result: dict):
+    line = (
+        f"concurrency={result['concurrency']:<4} requests={result['requests']:<5} "
+        f"errors={result['errors']:<4} time={result['seconds']:.2f}s "
+        f"throughput={result['throughput']:.2f} req/s"
+    )
+    if "p50" in result:
+        line += f" p50={result['p50']:.2f}s p95={result['p95']:.2f}s max={result['max']:.2f}s"
+    if "first_event_p50" in result:
+        line += f" first_event_p50={result['first_event_p50']:.2f}s"
+    print(line)
+    if "first_error" in result:
+        print(f"  first error: {result['first_error']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the MCP client's /query endpoint")
+    parser.add_argument("--url", default="http://localhost:8080", help="Base URL of the client service")
+    parser.add_argument("--text", default="Get me a greeting for Sarah", help="Query text to send")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels to test"
+    )
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--stream", action="store_true", help="Use /query/stream and report time to first event")
+    args = parser.parse_args()
+
+    print(f"Load testing {args.url}/query{'/stream' if args.stream else ''}")
+    for concurrency in args.concurrency:
+        print_result(
+            await run_level(args.url, args.text, concurrency, args.requests, args.timeout, args.stream)
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,303 @@
+"""
+A pool of MCP client sessions to one SSE server.
+
+Each session has its own SSE stream, so concurrent tool calls are spread over
+several connections instead of queueing on one. Requests go to the healthy
+session with the fewest calls in flight. A background task pings every
+session and reconnects the ones that dropped, with exponential backoff, so
+losing a connection only affects the calls that were running on it:
+
+    pool = MCPSessionPool("http://mcp-server:8000", size=4)
+    await pool.start()
+    result = await pool.call_tool("greeting", {"name": "Sarah"})
+    await pool.close()
+"""
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import time
+
+import anyio
+import httpx
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """Whether an exception means the session's connection is gone"""
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(
+        error, (anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.TransportError)
+    )
+
+
+class PooledSession:
+    """
+    One SSE connection and its ClientSession. The SSE transport must be opened
+    and closed in the same task, so a runner task holds both for the lifetime
+    of the connection.
+    """
+
+    def __init__(self, server_url: str, name: str, message_handler=None):
+        self.server_url = server_url
+        self.name = name
+        self.message_handler = message_handler
+        self.session: Optional[ClientSession] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.reconnects = -1  # The first connection is not a reconnect
+        self.retry_at = 0.0
+        self.retry_delay = 0.0
+        self._runner: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._broken = False
+        self._on_broken: Optional[Callable[[], None]] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.session is not None and not self._broken
+
+    async def connect(self, timeout: float):
+        """Open the connection and initialize the session"""
+        connected = asyncio.get_running_loop().create_future()
+        self._stop = asyncio.Event()
+        self._broken = False
+        self._runner = asyncio.create_task(self._run(connected))
+        try:
+            await asyncio.wait_for(asyncio.shield(connected), timeout)
+        except BaseException:
+            await self.close()
+            raise
+        self.reconnects += 1
+
+    async def _run(self, connected: asyncio.Future):
+        try:
+            async with sse_client(url=f"{self.server_url}/sse") as streams:
+                async with ClientSession(*streams, message_handler=self._handle_message) as session:
+                    await session.initialize()
+                    self.session = session
+                    connected.set_result(None)
+                    await self._stop.wait()
+        except Exception as e:
+            if not connected.done():
+                connected.set_exception(e)
+            else:
+                print(f"MCP {self.name} closed with error: {e}")
+        finally:
+            self.session = None
+            if not connected.done():
+                connected.cancel()
+            elif not self._stop.is_set():
+                self.mark_broken()
+
+    async def _handle_message(self, message):
+        if isinstance(message, Exception):
+            # The SSE reader reports a lost stream this way before closing it
+            print(f"MCP {self.name} stream error: {message}")
+            self.mark_broken()
+            return
+        if self.message_handler:
+            await self.message_handler(message)
+
+    def mark_broken(self):
+        """Take the session out of rotation until the health check reconnects it"""
+        if not self._broken:
+            self._broken = True
+            self.failures += 1
+            if self._on_broken:
+                self._on_broken()
+
+    async def ping(self, timeout: float):
+        await asyncio.wait_for(self.session.send_ping(), timeout)
+
+    async def close(self):
+        if self._runner is None:
+            return
+        self._stop.set()
+        if self.session is None:
+            # Still connecting: nothing to shut down cleanly
+            self._runner.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._runner), 5)
+        except BaseException:
+            # Shutdown of a dead connection can hang or fail; abandon it
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+        self._runner = None
+        self.session = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "reconnects": max(self.reconnects, 0),
+        }
+
+
+class MCPSessionPool:
+    """
+    Sessions to one MCP server over SSE. health_check_interval is the time
+    between pings; a session that does not answer within ping_timeout, or whose
+    stream fails, is closed and reconnected in the background.
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        size: int = 4,
+        message_handler=None,
+        health_check_interval: float = 15.0,
+        ping_timeout: float = 5.0,
+        connect_timeout: float = 10.0,
+        max_reconnect_delay: float = 30.0,
+    ):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.server_url = server_url
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        self.connect_timeout = connect_timeout
+        self.max_reconnect_delay = max_reconnect_delay
+        self.sessions = [
+            PooledSession(server_url, f"session-{index}", message_handler) for index in range(size)
+        ]
+        for session in self.sessions:
+            session._on_broken = self._wake_monitor
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._available = asyncio.Condition()
+
+    async def start(self):
+        """Connect all sessions; fails only if none of them could connect"""
+        await asyncio.gather(*(self._connect(session) for session in self.sessions))
+        if not any(session.healthy for session in self.sessions):
+            raise RuntimeError(f"Could not connect to MCP server at {self.server_url}")
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def close(self):
+        if self._monitor_task:
+            self._monitor_task.cancel()
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+        await asyncio.gather(*(session.close() for session in self.sessions))
+
+    async def _connect(self, session: PooledSession) -> bool:
+        try:
+            await session.connect(self.connect_timeout)
+        except Exception as e:
+            session.retry_delay = min(self.max_reconnect_delay, max(1.0, session.retry_delay * 2))
+            session.retry_at = time.monotonic() + session.retry_delay
+            print(f"MCP {session.name} could not connect ({e!r}), retrying in {session.retry_delay:.0f}s")
+            return False
+        session.retry_delay = 0.0
+        async with self._available:
+            self._available.notify_all()
+        return True
+
+    def _wake_monitor(self):
+        self._wake.set()
+
+    async def _monitor(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.health_check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await asyncio.gather(*(self._check(session) for session in self.sessions))
+            # Sessions waiting for their backoff need another look before the next interval
+            pending = [session.retry_at for session in self.sessions if not session.healthy]
+            if pending:
+                delay = max(0.0, min(pending) - time.monotonic())
+                if delay < self.health_check_interval:
+                    asyncio.get_running_loop().call_later(delay, self._wake.set)
+
+    async def _check(self, session: PooledSession):
+        if session.healthy:
+            try:
+                await session.ping(self.ping_timeout)
+                return
+            except Exception as e:
+                print(f"MCP {session.name} failed health check: {e!r}")
+                session.mark_broken()
+        if time.monotonic() < session.retry_at:
+            return
+        await session.close()
+        if await self._connect(session):
+            print(f"MCP {session.name} reconnected")
+
+    @asynccontextmanager
+    async def checkout(self, exclude=()):
+        """The healthy session with the fewest calls in flight, waiting for a reconnect if none is healthy"""
+        async with self._available:
+            try:
+                await asyncio.wait_for(
+                    self._available.wait_for(lambda: self._pick(exclude) is not None),
+                    self.connect_timeout,
+                )
+            except asyncio.TimeoutError:
+                raise RuntimeError("No healthy MCP session available") from None
+            session = self._pick(exclude)
+        session.in_flight += 1
+        session.calls += 1
+        try:
+            yield session
+        except Exception as e:
+            if is_connection_error(e):
+                session.mark_broken()
+            raise
+        finally:
+            session.in_flight -= 1
+
+    def _pick(self, exclude=()) -> Optional[PooledSession]:
+        candidates = [
+            session for session in self.sessions if session.healthy and session not in exclude
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda session: session.in_flight)
+
+    async def run(self, func: Callable[[ClientSession], Awaitable[Any]]) -> Any:
+        """
+        Run func(session) on a pooled session. If the connection drops during the
+        call, it is retried once on another session, or on the same one after it
+        reconnected if the pool has only one.
+        """
+        tried = []
+        for attempt in range(2):
+            exclude = tried if len(tried) < len(self.sessions) else ()
+            async with self.checkout(exclude=exclude) as session:
+                try:
+                    return await func(session.session)
+                except Exception as e:
+                    if not is_connection_error(e) or attempt == 1:
+                        raise
+                    session.mark_broken()
+                    tried.append(session)
+                    print(f"MCP {session.name} lost its connection, retrying the call")
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]):
+        return await self.run(lambda session: session.call_tool(name, arguments))
+
+    async def list_tools(self) -> List[Any]:
+        """All tools of the server, following pagination"""
+        async def list_all(session: ClientSession):
+            tools = []
+            cursor = None
+            while True:
+                response = await session.list_tools(cursor)
+                tools.extend(response.tools)
+                cursor = response.nextCursor
+                if not cursor:
+                    return tools
+
+        return await self.run(list_all)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Health, load and reconnect counters per session"""
+        return {session.name: session.stats() for session in self.sessions}
@@ -1,8 +1,15 @@
+import argparse
 import asyncio
-from mcp import StdioServerParameters
-from converse_agent import ConverseAgent
+import contextlib
+import json
+import sys
+import time
+from functools import partial
+from converse_agent import ConverseAgent, create_bedrock_client
+from converse_history import ConverseHistoryManager
 from converse_tools import ConverseToolManager
-from mcp_client import MCPClient
+from rate_limiter import BedrockRateLimiter
+from tracing import JsonlSpanExporter, OpenTelemetrySpanExporter, Tracer, set_tracer
 import os
 from datetime import datetime
 
@@ -44,88 +51,295 @@ def format_message(role: str, content: str) -> str:
     else:
         return f"{Colors.GREEN}Assistant: {Colors.END}{content}"
 
+def format_usage(iteration_stats) -> str:
+    """Summarize the token usage of one agent turn, including prompt cache reads and writes"""
+    totals = {key: sum(stats[key] for stats in iteration_stats)
+              for key in ('input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens')}
+    return (f"{Colors.CYAN}[{len(iteration_stats)} model calls | in {totals['input_tokens']} "
+            f"out {totals['output_tokens']} | cache read {totals['cache_read_tokens']} "
+            f"write {totals['cache_write_tokens']}]{Colors.END}")
+
+def configure_tracing():
+    """
+    Enable span export for model, tool and MCP calls:
+    CONVERSE_TRACE_FILE=<path> writes JSON Lines, CONVERSE_TRACE_OTEL=1 mirrors
+    spans into the configured OpenTelemetry tracer provider.
+    """
+    exporters = []
+    if os.getenv("CONVERSE_TRACE_FILE"):
+        exporters.append(JsonlSpanExporter(os.environ["CONVERSE_TRACE_FILE"]))
+    if os.getenv("CONVERSE_TRACE_OTEL") == "1":
+        exporters.append(OpenTelemetrySpanExporter())
+    tracer = Tracer(exporters)
+    set_tracer(tracer)
+    return tracer
+
 async def handle_resource_update(uri: str):
     """Handle updates to resources from the MCP server"""
     print(f"{Colors.YELLOW}Resource updated: {uri}{Colors.END}")
     # You could trigger a refresh of the resource here if needed
     
-async def main():
-    """
-    Main function that sets up and runs an interactive AI agent with tool integration.
-    The agent can process user prompts and utilize registered tools to perform tasks.
-    """
-    # Initialize model configuration
-    model_id = "anthropic.claude-3-5-sonnet-20241022-v2:0"
-    
-    # Set up the agent and tool manager
-    agent = ConverseAgent(model_id)
-    agent.tools = ConverseToolManager()
+MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
 
-    # Define the agent's behavior through system prompt
-    agent.system_prompt = """You are a helpful assistant that can use tools to help you answer 
+# Define the agent's behavior through system prompt
+SYSTEM_PROMPT = """You are a helpful assistant that can use tools to help you answer 
 questions and perform tasks."""
 
+def create_agent(tools, client=None, rate_limiter=None):
+    """Create an agent using the shared tool manager (and Bedrock client and rate limiter, if given)"""
+    agent = ConverseAgent(MODEL_ID, client=client)
+    agent.tools = tools
+    agent.rate_limiter = rate_limiter
+    agent.system_prompt = SYSTEM_PROMPT
+    # Cache the system prompt, tool specs and conversation prefix between calls.
+    # Requires a model with Bedrock prompt caching support.
+    agent.prompt_caching = False
+    return agent
+
+def create_mcp_manager(replicas=1):
+    # The MCP SDK takes a while to import; it is loaded here, while the Bedrock client is created
+    from mcp import StdioServerParameters
+    from mcp_manager import MCPClientManager
+
     # Create server parameters for stdio configuration
     server_params = StdioServerParameters(
         command="python",
         args=["mcp_server.py"],
-        env=None
+        # Only a minimal environment reaches the server; pass its log level on explicitly
+        env={"MCP_SERVER_LOG_LEVEL": os.environ["MCP_SERVER_LOG_LEVEL"]}
+        if os.getenv("MCP_SERVER_LOG_LEVEL") else None
     )
 
-    # Initialize MCP client with server parameters
-    async with MCPClient(server_params) as mcp_client:
-        # Register resource update handler
-        mcp_client.on_resource_update(handle_resource_update)
-
-        # # Fetch and display available resources
-        # resources = await mcp_client.get_available_resources()
-        # print("Available resources:", resources)
+    # Add more servers (stdio parameters or HTTP URLs) to merge their tools.
+    # CPU heavy servers can run several replicas to spread concurrent calls.
+    mcp_manager = MCPClientManager()
+    mcp_manager.add_server("demo", server_params, replicas=replicas)
+    return mcp_manager
 
-        # for resource in resources:
-        #     try:
-        #         await mcp_client.session.subscribe_resource(resource.uri)
-        #     except Exception as e:
-        #         print(f"Error subscribing to resource {resource.uri}: {e}")
-
-        # Fetch available tools from the MCP client
-        tools = await mcp_client.get_available_tools()
+@contextlib.asynccontextmanager
+async def start_app(replicas=1, max_attempts=None):
+    """
+    Start the MCP servers and create the Bedrock client, yielding (client, mcp_manager).
+    The Bedrock client (importing boto3 included) is created on a thread while
+    the MCP SDK is imported and the servers start.
+    """
+    loop = asyncio.get_running_loop()
+    client_future = loop.run_in_executor(None, partial(create_bedrock_client, 'us-west-2', max_attempts=max_attempts))
+    mcp_manager = create_mcp_manager(replicas)
+    await mcp_manager.start()
+    client = await client_future
+    try:
+        yield client, mcp_manager
+    finally:
+        await mcp_manager.stop()
 
-        # Register each available tool with the agent
+async def register_mcp_tools(mcp_manager, tool_manager):
+    """
+    Register the merged tool catalog of all servers with the tool manager, and
+    follow later changes to it. Calls are routed to the right server.
+    """
+    async def register_tools(tools):
+        tool_manager.clear_tools()
         for tool in tools:
-            agent.tools.register_tool(
+            tool_manager.register_tool(
                 name=tool['name'],
-                func=mcp_client.call_tool,
+                func=mcp_manager.call_tool,
                 description=tool['description'],
-                input_schema={'json': tool['inputSchema']}
+                input_schema=tool['inputSchema'],
+                # Reuse results of tools the server marks as read-only and closed-world
+                cacheable=ConverseToolManager.is_cacheable(tool['annotations'])
             )
 
-        print_welcome()
-        print_tools(tools)  # Print available tools after welcome message
+    tools = await mcp_manager.get_available_tools()
+    await register_tools(tools)
+    mcp_manager.on_tools_changed(register_tools)
+    return tools
 
-        # Start interactive prompt loop
-        while True:
-            try:
-                # Get user input and check for exit commands
-                user_prompt = input(f"\n{Colors.BOLD}User: {Colors.END}")
-                if user_prompt.lower() in ['quit', 'exit', 'q']:
-                    print(f"\n{Colors.CYAN}Goodbye! Thanks for chatting!{Colors.END}")
-                    break
+async def main():
+    """
+    Main function that sets up and runs an interactive AI agent with tool integration.
+    The agent can process user prompts and utilize registered tools to perform tasks.
+    """
+    tracer = configure_tracing()
+
+    # Print the response token by token as it is generated (uses converse_stream)
+    stream_responses = True
+    
+    try:
+        # Start the MCP servers and the Bedrock client concurrently
+        async with start_app() as (client, mcp_manager):
+            # Set up the agent and tool manager
+            agent = create_agent(ConverseToolManager(), client=client)
+            # Keep the conversation within a token budget, summarizing old turns
+            agent.history = ConverseHistoryManager(max_tokens=50000, summarizer=agent.summarize)
+
+            # Register resource update handler
+            mcp_manager.on_resource_update(handle_resource_update)
+
+            # # Fetch and display available resources. Reading a resource subscribes to it
+            # # (if the server supports it) and caches it until the server reports an update.
+            # mcp_client = mcp_manager.get_client("demo")
+            # resources = await mcp_client.get_available_resources()
+            # print("Available resources:", resources)
+            # for resource in resources:
+            #     print(await mcp_client.get_resource(str(resource.uri)))
+
+            tools = await register_mcp_tools(mcp_manager, agent.tools)
+
+            print_welcome()
+            print_tools(tools)  # Print available tools after welcome message
+
+            # Start interactive prompt loop
+            while True:
+                try:
+                    # Get user input and check for exit commands
+                    user_prompt = input(f"\n{Colors.BOLD}User: {Colors.END}")
+                    if user_prompt.lower() in ['quit', 'exit', 'q']:
+                        print(f"\n{Colors.CYAN}Goodbye! Thanks for chatting!{Colors.END}")
+                        break
                 
-                # Skip empty input
-                if not user_prompt.strip():
-                    continue
+                    # Skip empty input
+                    if not user_prompt.strip():
+                        continue
                 
-                # Process the prompt and display the response
-                print(f"\n{Colors.YELLOW}Thinking...{Colors.END}")
-                response = await agent.invoke_with_prompt(user_prompt)
-                print(f"\n{format_message('assistant', response)}")
+                    # Process the prompt and display the response
+                    print(f"\n{Colors.YELLOW}Thinking...{Colors.END}")
+                    if stream_responses:
+                        print(f"\n{format_message('assistant', '')}", end='', flush=True)
+                        async for delta in agent.invoke_stream(user_prompt):
+                            print(delta, end='', flush=True)
+                        print()
+                    else:
+                        response = await agent.invoke_with_prompt(user_prompt)
+                        print(f"\n{format_message('assistant', response)}")
+                    print(format_usage(agent.iteration_stats))
                 
-            except KeyboardInterrupt:
-                print(f"\n{Colors.CYAN}Goodbye! Thanks for chatting!{Colors.END}")
-                break
+                except KeyboardInterrupt:
+                    print(f"\n{Colors.CYAN}Goodbye! Thanks for chatting!{Colors.END}")
+                    break
+                except Exception as e:
+                    print(f"\n{Colors.RED}Error: {str(e)}{Colors.END}")
+    finally:
+        # Flush buffered spans, also when exiting through an exception or Ctrl-C
+        tracer.shutdown()
+
+def read_prompts(source):
+    """
+    Yield (id, prompt, error) for each line of a JSONL file or stdin ('-'). Each
+    line is either a JSON object with a "prompt" (and optional "id") or plain
+    prompt text. For a line that can't be used, prompt is None and error says why.
+    """
+    stream = sys.stdin if source == '-' else open(source)
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, None, f"Line {line_number} is not valid JSON: {e}"
+                    continue
+                if not isinstance(item.get('prompt'), str):
+                    yield item.get('id', line_number), None, f"Line {line_number} has no prompt"
+                    continue
+                yield item.get('id', line_number), item['prompt'], None
+            else:
+                yield line_number, line, None
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+async def run_batch(source, output, concurrency=8, replicas=1, requests_per_minute=None,
+                    tokens_per_minute=None):
+    """
+    Run every prompt of source through its own agent, at most `concurrency` at a
+    time. The agents share one Bedrock client, rate limiter, tool manager and set
+    of MCP servers. Results are written to output as JSON Lines in completion order.
+    """
+    tracer = configure_tracing()
+    rate_limiter = BedrockRateLimiter(requests_per_minute, tokens_per_minute, max_concurrency=concurrency)
+    tool_manager = ConverseToolManager()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    out = sys.stdout if output == '-' else open(output, 'w')
+    counts = {'ok': 0, 'error': 0}
+
+    async def run_one(item_id, prompt):
+        try:
+            agent = create_agent(tool_manager, client=client, rate_limiter=rate_limiter)
+            started = time.perf_counter()
+            result = {'id': item_id, 'prompt': prompt}
+            try:
+                result['response'] = await agent.invoke_with_prompt(prompt)
+                counts['ok'] += 1
             except Exception as e:
-                print(f"\n{Colors.RED}Error: {str(e)}{Colors.END}")
+                result['error'] = f"{type(e).__name__}: {e}"
+                counts['error'] += 1
+            result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            result['model_calls'] = len(agent.iteration_stats)
+            result['tool_calls'] = sum(stats['tool_calls'] for stats in agent.iteration_stats)
+            result['usage'] = {
+                key: sum(stats[key] for stats in agent.iteration_stats)
+                for key in ('input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens')
+            }
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+        finally:
+            semaphore.release()
+
+    started = time.perf_counter()
+    try:
+        # Keep stdout for results; diagnostics printed along the way go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            # Throttling is handled by the rate limiter, which adapts the Bedrock concurrency
+            async with start_app(replicas, max_attempts=2) as (client, mcp_manager):
+                await register_mcp_tools(mcp_manager, tool_manager)
+                tasks = []
+                prompts = read_prompts(source)
+                try:
+                    while True:
+                        # Read on a thread: a slow producer on stdin must not stall the running agents
+                        line = await asyncio.to_thread(next, prompts, None)
+                        if line is None:
+                            break
+                        item_id, prompt, error = line
+                        if error:
+                            # A bad line gets an error record; the rest of the batch goes on
+                            out.write(json.dumps({'id': item_id, 'error': error}) + '\n')
+                            out.flush()
+                            counts['error'] += 1
+                            continue
+                        # Wait for a free slot before reading on, so large files are not loaded at once
+                        await semaphore.acquire()
+                        tasks.append(asyncio.create_task(run_one(item_id, prompt)))
+                finally:
+                    await asyncio.gather(*tasks)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        tracer.shutdown()
+    elapsed = time.perf_counter() - started
+    print(f"Processed {counts['ok'] + counts['error']} prompts ({counts['error']} failed) "
+          f"in {elapsed:.1f}s", file=sys.stderr)
+    print(f"Rate limiter: {rate_limiter.stats()}", file=sys.stderr)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Converse agent with MCP tools")
+    parser.add_argument('--batch', metavar='PROMPTS',
+                        help="run prompts from a JSONL file ('-' for stdin) instead of the interactive prompt")
+    parser.add_argument('--output', default='-', help="batch results JSONL file (default stdout)")
+    parser.add_argument('--concurrency', type=int, default=8, help="batch prompts run at the same time")
+    parser.add_argument('--mcp-replicas', type=int, default=1, help="batch MCP server replicas")
+    parser.add_argument('--rpm', type=float, help="batch Bedrock requests per minute quota")
+    parser.add_argument('--tpm', type=float, help="batch Bedrock tokens per minute quota")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    # Run the async main function
-    asyncio.run(main()) 
\ No newline at end of file
+    args = parse_args()
+    if args.batch:
+        asyncio.run(run_batch(args.batch, args.output, args.concurrency, args.mcp_replicas,
+                              args.rpm, args.tpm))
+    else:
+        # Run the async main function
+        asyncio.run(main())
@@ -0,0 +1,209 @@
+"""
+Failover and hedging across several Bedrock endpoints.
+
+An endpoint is a region plus, optionally, a different model ID: an inference
+profile or a fallback model. Calls go to a healthy endpoint chosen at random,
+weighted by its recent latency and load. Endpoints that keep failing are
+skipped for a cooldown period. With hedge_after set, a call that has not
+finished within that many seconds is also sent to a second endpoint, and the
+first answer wins:
+
+    pool = BedrockEndpointPool([
+        BedrockEndpoint('us-west-2'),
+        BedrockEndpoint('us-east-1'),
+        BedrockEndpoint('us-east-2', model_id='us.anthropic.claude-3-5-haiku-20241022-v1:0', weight=0.2),
+    ], hedge_after=5.0)
+    agent.endpoint_pool = pool
+
+Endpoints accept any client object, so routing can be exercised with stubs.
+"""
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import random
+import time
+from tracing import current_span
+
+# Errors worth retrying on another endpoint. Anything else (e.g. a
+# ValidationException) would fail the same way everywhere.
+FAILOVER_ERROR_CODES = (
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+    'InternalServerException', 'ModelNotReadyException', 'ModelTimeoutException'
+)
+
+def is_failover_error(error: BaseException) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in FAILOVER_ERROR_CODES
+    return isinstance(error, (BotocoreConnectionError, ReadTimeoutError))
+
+class BedrockEndpoint:
+    """A region (and optionally a model ID overriding the agent's) with its health and latency"""
+    def __init__(self, region: str, model_id: Optional[str] = None, client=None, weight: float = 1.0,
+                 name: Optional[str] = None):
+        self.region = region
+        self.model_id = model_id
+        self.weight = weight
+        self.name = name or (f"{region}/{model_id}" if model_id else region)
+        self._client = client
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Imported here to avoid a circular import with converse_agent
+            from converse_agent import create_bedrock_client
+            self._client = create_bedrock_client(self.region, max_attempts=1)
+        return self._client
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'healthy': self.healthy(time.monotonic()),
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'failures': self.failures
+        }
+
+class BedrockEndpointPool:
+    """
+    Routes Bedrock calls over several endpoints.
+
+    failure_threshold consecutive failures take an endpoint out of rotation for
+    cooldown seconds; afterwards a single trial call decides whether it stays.
+    hedge_after (seconds, None = no hedging) is the latency objective after which
+    a non-streaming call is duplicated on another endpoint, up to max_attempts
+    endpoints per call. Failed calls are retried on another endpoint within the
+    same max_attempts.
+    """
+    def __init__(self, endpoints: List[BedrockEndpoint], hedge_after: Optional[float] = None,
+                 max_attempts: int = 2, failure_threshold: int = 3, cooldown: float = 30.0,
+                 latency_smoothing: float = 0.3, rng: Optional[random.Random] = None):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = list(endpoints)
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency_smoothing = latency_smoothing
+        self._random = rng or random.Random()
+
+    def pick(self, exclude=()) -> Optional[BedrockEndpoint]:
+        """
+        Choose an endpoint not in exclude: healthy ones at random, weighted by
+        weight / (latency * (1 + in flight calls)). When none is healthy, the one
+        whose cooldown ends first gets a trial call.
+        """
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda endpoint: endpoint.unhealthy_until)
+        # Endpoints without measurements count as the fastest, so they get tried
+        measured = [endpoint.latency for endpoint in healthy if endpoint.latency is not None]
+        fastest = min(measured) if measured else 1.0
+        weights = [
+            endpoint.weight / ((endpoint.latency or fastest) * (1 + endpoint.in_flight))
+            for endpoint in healthy
+        ]
+        return self._random.choices(healthy, weights=weights)[0]
+
+    async def call(self, request: Dict[str, Any], func: Callable[[BedrockEndpoint, Dict], Awaitable[Any]],
+                   hedge: bool = True, can_retry: Optional[Callable[[], bool]] = None) -> Any:
+        """
+        Run func(endpoint, request) on an endpoint, with the request's modelId
+        replaced by the endpoint's model ID if it has one. Streaming calls should
+        pass hedge=False, as their output is consumed while it arrives, and a
+        can_retry() that says whether a failed attempt may still be repeated.
+        """
+        tried = []
+        pending = set()
+        last_error = None
+        launch = True
+        try:
+            while True:
+                # Start an attempt at first, after a failure, or when the hedging deadline passed
+                if launch and len(tried) < self.max_attempts:
+                    endpoint = self.pick(exclude=tried)
+                    if endpoint is not None:
+                        tried.append(endpoint)
+                        pending.add(asyncio.create_task(self._attempt(endpoint, request, func)))
+                        current_span().set_attributes({'endpoint': endpoint.name, 'endpoint_attempts': len(tried)})
+                if not pending:
+                    raise last_error or RuntimeError("No Bedrock endpoint available")
+
+                can_hedge = hedge and self.hedge_after is not None and len(tried) < self.max_attempts
+                done, pending = await asyncio.wait(
+                    pending, timeout=self.hedge_after if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    current_span().set_attribute('hedged', True)
+                for task in done:
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        if not is_failover_error(e) or (can_retry and not can_retry()):
+                            raise
+                        last_error = e
+                launch = not done or not pending
+        finally:
+            # Losing hedged attempts are abandoned; their result is ignored
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, endpoint: BedrockEndpoint, request: Dict[str, Any], func):
+        if endpoint.model_id:
+            request = {**request, 'modelId': endpoint.model_id}
+        endpoint.in_flight += 1
+        endpoint.calls += 1
+        started = time.perf_counter()
+        try:
+            result = await func(endpoint, request)
+        except asyncio.CancelledError:
+            # Lost a hedge: it took at least this long, which should count against it.
+            # An endpoint that was never measured gets this as its first estimate, or
+            # a slow endpoint that always loses would keep looking as fast as any other
+            elapsed = time.perf_counter() - started
+            if endpoint.latency is None or elapsed > endpoint.latency:
+                self._record_latency(endpoint, elapsed)
+            raise
+        except Exception as e:
+            if is_failover_error(e):
+                self._record_failure(endpoint)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+        self._record_success(endpoint, time.perf_counter() - started)
+        return result
+
+    def _record_success(self, endpoint: BedrockEndpoint, latency: float):
+        endpoint.consecutive_failures = 0
+        endpoint.unhealthy_until = 0.0
+        self._record_latency(endpoint, latency)
+
+    def _record_latency(self, endpoint: BedrockEndpoint, latency: float):
+        if endpoint.latency is None:
+            endpoint.latency = latency
+        else:
+            endpoint.latency += self.latency_smoothing * (latency - endpoint.latency)
+
+    def _record_failure(self, endpoint: BedrockEndpoint):
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.unhealthy_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Health, smoothed latency and call counts per endpoint"""
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
@@ -0,0 +1,384 @@
+"""
+Offline benchmarks for the Converse agent loop.
+
+Bedrock is replaced by a stub client, so these run without AWS credentials.
+All workloads except event-loop use the real mcp_server.py over stdio:
+
+    python benchmark.py event-loop --agents 32 --latency 0.5
+    python benchmark.py turns --turns 50
+    python benchmark.py tools --tool-counts 1,10,100,500
+    python benchmark.py parallel --parallel-counts 1,2,4,8,16
+    python benchmark.py startup --repeat 5
+    python benchmark.py app-startup --repeat 5
+    python benchmark.py memory --sessions 20 --turns 10
+"""
+import argparse
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+
+from mcp import StdioServerParameters
+
+from converse_agent import ConverseAgent
+from converse_tools import ConverseToolManager
+from mcp_manager import MCPClientManager
+
+
+class FakeBedrockClient:
+    """
+    Stand-in for a bedrock-runtime client whose converse call blocks the
+    calling thread for `latency` seconds, like a real network request
+    """
+    def __init__(self, latency=0.5):
+        self.latency = latency
+
+    def converse(self, **kwargs):
+        time.sleep(self.latency)
+        return {
+            'output': {
+                'message': {
+                    'role': 'assistant',
+                    'content': [{'text': 'ok'}]
+                }
+            },
+            'stopReason': 'end_turn',
+            'usage': {'inputTokens': 10, 'outputTokens': 1, 'totalTokens': 11},
+            'metrics': {'latencyMs': int(self.latency * 1000)}
+        }
+
+
+class ScriptedBedrockClient:
+    """
+    Stand-in for a bedrock-runtime client that plays a fixed script for every
+    user turn: `tool_rounds` rounds of `parallel_tools` calculator calls, then
+    a final answer. The script position is derived from the request messages,
+    so one client can serve many agents.
+    """
+    def __init__(self, tool_rounds=1, parallel_tools=1, latency=0.0, tool_name='calculator'):
+        self.tool_rounds = tool_rounds
+        self.parallel_tools = parallel_tools
+        self.latency = latency
+        self.tool_name = tool_name
+        self.calls = 0
+
+    def converse(self, modelId, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        # Count the tool rounds since the last user prompt
+        rounds = 0
+        for message in reversed(messages):
+            if message['role'] == 'user' and not any('toolResult' in block for block in message['content']):
+                break
+            if message['role'] == 'user':
+                rounds += 1
+
+        if rounds < self.tool_rounds:
+            content = [
+                {
+                    'toolUse': {
+                        'toolUseId': f"tool-{self.calls}-{index}",
+                        'name': self.tool_name,
+                        'input': {'operation': 'add', 'x': self.calls, 'y': index}
+                    }
+                }
+                for index in range(self.parallel_tools)
+            ]
+            stop_reason = 'tool_use'
+        else:
+            content = [{'text': f"Done after {rounds} tool rounds."}]
+            stop_reason = 'end_turn'
+
+        input_tokens = sum(len(str(message['content'])) for message in messages) // 4
+        return {
+            'output': {'message': {'role': 'assistant', 'content': content}},
+            'stopReason': stop_reason,
+            'usage': {'inputTokens': input_tokens, 'outputTokens': 20, 'totalTokens': input_tokens + 20},
+            'metrics': {'latencyMs': int(self.latency * 1000)}
+        }
+
+
+class BlockingConverseAgent(ConverseAgent):
+    """ConverseAgent that calls boto3 directly on the event loop, as before the executor was added"""
+    async def _get_converse_response(self):
+        return self.client.converse(**self._build_converse_request())
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def format_latencies(label, seconds):
+    return (f"{label}: n={len(seconds)} p50={percentile(seconds, 50) * 1000:.2f}ms "
+            f"p95={percentile(seconds, 95) * 1000:.2f}ms p99={percentile(seconds, 99) * 1000:.2f}ms")
+
+
+def server_params():
+    return StdioServerParameters(command=sys.executable, args=["mcp_server.py"], env=None)
+
+
+async def start_mcp(replicas=1):
+    """Start mcp_server.py and return the running manager and its startup time"""
+    started = time.perf_counter()
+    manager = MCPClientManager()
+    manager.add_server("demo", server_params(), replicas=replicas)
+    await manager.start()
+    return manager, time.perf_counter() - started
+
+
+async def build_tools(manager, tool_rtts, extra_tools=0):
+    """
+    Register the server's tools, timing every MCP round trip. extra_tools
+    synthetic copies of calculator are added to scale the tool catalog.
+    """
+    async def timed_call(name, arguments):
+        started = time.perf_counter()
+        try:
+            return await manager.call_tool(name, arguments)
+        finally:
+            tool_rtts.append(time.perf_counter() - started)
+
+    async def synthetic_call(name, arguments):
+        return await timed_call('calculator', arguments)
+
+    tools = ConverseToolManager()
+    catalog = await manager.get_available_tools()
+    for tool in catalog:
+        tools.register_tool(tool['name'], timed_call, tool['description'], tool['inputSchema'])
+    calculator = next(tool for tool in catalog if tool['name'] == 'calculator')
+    for index in range(extra_tools):
+        tools.register_tool(f"calculator_{index}", synthetic_call, calculator['description'],
+                            calculator['inputSchema'])
+    return tools
+
+
+def make_agent(tools, client):
+    agent = ConverseAgent('benchmark-model', client=client)
+    agent.tools = tools
+    return agent
+
+
+async def run_turns(agent, turns):
+    """Run a conversation of `turns` prompts, returning per-turn latencies"""
+    latencies = []
+    for turn in range(turns):
+        started = time.perf_counter()
+        await agent.invoke_with_prompt(f"Question {turn}")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def measure_loop_lag(stop, interval=0.01):
+    """Record how late a periodic timer fires, i.e. how long the event loop was blocked"""
+    lags = []
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+    return lags
+
+
+async def run_agents(agent_class, agents, latency):
+    tools = ConverseToolManager()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+
+    async def run_one():
+        agent = agent_class('fake-model', client=FakeBedrockClient(latency))
+        agent.tools = tools
+        await agent.invoke_with_prompt('hello')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one() for _ in range(agents)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = await lag_task
+    return elapsed, lags
+
+
+async def benchmark_event_loop(args):
+    """Compare N concurrent agents with blocking vs executor-backed Bedrock calls"""
+    print(f"{args.agents} concurrent agents, {args.latency}s simulated model latency")
+    print(f"{'mode':<10} {'wall s':>8} {'turns/s':>8} {'max lag ms':>11} {'p99 lag ms':>11}")
+    for mode, agent_class in [('blocking', BlockingConverseAgent), ('executor', ConverseAgent)]:
+        elapsed, lags = await run_agents(agent_class, args.agents, args.latency)
+        print(
+            f"{mode:<10} {elapsed:>8.2f} {args.agents / elapsed:>8.1f} "
+            f"{max(lags, default=0) * 1000:>11.1f} {percentile(lags, 99) * 1000:>11.1f}"
+        )
+
+
+async def benchmark_turns(args):
+    """Turns per second and tool round trip latency for one long conversation"""
+    manager, startup = await start_mcp()
+    try:
+        tool_rtts = []
+        tools = await build_tools(manager, tool_rtts)
+        client = ScriptedBedrockClient(tool_rounds=args.tool_rounds, parallel_tools=1, latency=args.latency)
+        agent = make_agent(tools, client)
+        started = time.perf_counter()
+        latencies = await run_turns(agent, args.turns)
+        elapsed = time.perf_counter() - started
+        print(f"MCP startup: {startup * 1000:.1f}ms")
+        print(f"{args.turns} turns in {elapsed:.2f}s = {args.turns / elapsed:.1f} turns/s "
+              f"({client.calls} model calls, {len(agent.messages)} messages)")
+        print(format_latencies("turn latency", latencies))
+        print(format_latencies("tool round trip", tool_rtts))
+    finally:
+        await manager.stop()
+
+
+async def benchmark_tools(args):
+    """Turn latency as the number of registered tools grows"""
+    manager, _ = await start_mcp()
+    try:
+        print(f"{'tools':>6} {'turns/s':>8} {'p50 turn ms':>12} {'get_tools us':>13}")
+        for count in args.tool_counts:
+            tools = await build_tools(manager, [], extra_tools=max(0, count - 2))
+            agent = make_agent(tools, ScriptedBedrockClient(tool_rounds=1, latency=args.latency))
+            started = time.perf_counter()
+            latencies = await run_turns(agent, args.turns)
+            elapsed = time.perf_counter() - started
+            spec_started = time.perf_counter()
+            for _ in range(1000):
+                tools.get_tools()
+            spec_us = (time.perf_counter() - spec_started) * 1000
+            print(f"{count:>6} {args.turns / elapsed:>8.1f} {percentile(latencies, 50) * 1000:>12.2f} "
+                  f"{spec_us:>13.2f}")
+    finally:
+        await manager.stop()
+
+
+async def benchmark_parallel(args):
+    """Turn latency as the number of tool calls per model response grows"""
+    manager, _ = await start_mcp(replicas=args.replicas)
+    try:
+        print(f"{'parallel':>8} {'p50 turn ms':>12} {'p95 turn ms':>12} {'p50 tool ms':>12}")
+        for count in args.parallel_counts:
+            tool_rtts = []
+            tools = await build_tools(manager, tool_rtts)
+            agent = make_agent(tools, ScriptedBedrockClient(tool_rounds=1, parallel_tools=count,
+                                                            latency=args.latency))
+            agent.max_tool_concurrency = count
+            latencies = await run_turns(agent, args.turns)
+            print(f"{count:>8} {percentile(latencies, 50) * 1000:>12.2f} "
+                  f"{percentile(latencies, 95) * 1000:>12.2f} {percentile(tool_rtts, 50) * 1000:>12.2f}")
+    finally:
+        await manager.stop()
+
+
+async def benchmark_startup(args):
+    """Time to a started MCP server with a listed tool catalog"""
+    timings = []
+    for _ in range(args.repeat):
+        manager, startup = await start_mcp()
+        await manager.stop()
+        timings.append(startup)
+    print(format_latencies("MCP startup + tool listing", timings))
+
+
+# Run in a fresh interpreter, so module imports are part of the measured startup
+APP_STARTUP_SCRIPT = """
+import asyncio, app
+from converse_tools import ConverseToolManager
+
+async def ready():
+    async with app.start_app() as (client, mcp_manager):
+        await app.register_mcp_tools(mcp_manager, ConverseToolManager())
+        print('ready', flush=True)
+
+asyncio.run(ready())
+"""
+
+async def time_app_startup():
+    """Seconds from launching app.py's startup until the first prompt could be sent"""
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', APP_STARTUP_SCRIPT,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    ready = None
+    async for line in process.stdout:
+        # Other output of the app may share the line
+        if ready is None and b'ready' in line:
+            ready = time.perf_counter() - started
+    await process.wait()
+    if ready is None:
+        raise RuntimeError("app startup failed")
+    return ready
+
+async def benchmark_app_startup(args):
+    """First prompt readiness of app.py, module imports included"""
+    timings = [await time_app_startup() for _ in range(args.repeat)]
+    print(format_latencies("app startup", timings))
+
+async def benchmark_memory(args):
+    """Python heap allocated per agent session after a conversation of --turns turns"""
+    manager, _ = await start_mcp()
+    try:
+        tools = await build_tools(manager, [])
+        client = ScriptedBedrockClient(tool_rounds=args.tool_rounds, latency=0)
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+        agents = []
+        for _ in range(args.sessions):
+            agent = make_agent(tools, client)
+            await run_turns(agent, args.turns)
+            agents.append(agent)
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in snapshot.compare_to(baseline, 'filename'))
+        print(f"{args.sessions} sessions x {args.turns} turns: "
+              f"{allocated / args.sessions / 1024:.1f} KiB per session")
+    finally:
+        await manager.stop()
+
+
+WORKLOADS = {
+    'event-loop': benchmark_event_loop,
+    'turns': benchmark_turns,
+    'tools': benchmark_tools,
+    'parallel': benchmark_parallel,
+    'startup': benchmark_startup,
+    'app-startup': benchmark_app_startup,
+    'memory': benchmark_memory,
+}
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('workload', choices=sorted(WORKLOADS))
+    parser.add_argument('--agents', type=int, default=32, help='event-loop: number of concurrent agents')
+    parser.add_argument('--latency', type=float, default=None,
+                        help='simulated model latency in seconds (default 0.5 for event-loop, else 0)')
+    parser.add_argument('--turns', type=int, default=20, help='user turns per conversation')
+    parser.add_argument('--tool-rounds', type=int, default=1, help='tool rounds per user turn')
+    parser.add_argument('--tool-counts', type=int_list, default=[2, 10, 100, 500],
+                        help='tools: comma separated numbers of registered tools')
+    parser.add_argument('--parallel-counts', type=int_list, default=[1, 2, 4, 8, 16],
+                        help='parallel: comma separated numbers of tool calls per response')
+    parser.add_argument('--replicas', type=int, default=1, help='parallel: MCP server replicas')
+    parser.add_argument('--repeat', type=int, default=5, help='startup, app-startup: number of startups')
+    parser.add_argument('--sessions', type=int, default=10, help='memory: number of agent sessions')
+    args = parser.parse_args()
+    if args.latency is None:
+        args.latency = 0.5 if args.workload == 'event-loop' else 0.0
+    asyncio.run(WORKLOADS[args.workload](args))
+
+
+if __name__ == "__main__":
+    main()
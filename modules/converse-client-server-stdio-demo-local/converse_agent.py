@@ -1,101 +1,554 @@
-import boto3, json, re
+import asyncio
+import contextlib
+import json, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from rate_limiter import estimate_request_tokens
+from tracing import get_tracer
+
+# boto3 is synchronous, so Bedrock calls run on a bounded thread pool shared by
+# all agents in the process. The client connection pool is sized to match.
+BEDROCK_MAX_WORKERS = 16
+_default_executor = None
+
+def get_default_executor():
+    """Return the process-wide executor used for Bedrock calls"""
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = ThreadPoolExecutor(
+            max_workers=BEDROCK_MAX_WORKERS,
+            thread_name_prefix='bedrock'
+        )
+    return _default_executor
+
+# Joins the text of the turns of one answer, e.g. text before and after a tool call
+TURN_SEPARATOR = '\n\n'
+
+# Marks the end of a prefix Bedrock may cache between calls
+CACHE_POINT = {'cachePoint': {'type': 'default'}}
+
+def create_bedrock_client(region, max_attempts=None):
+    """
+    max_attempts limits the SDK's own retries; use a low value with a
+    BedrockRateLimiter so throttling reaches the limiter instead of being retried blindly
+    """
+    # boto3 takes a while to import; it is only loaded once a client is needed
+    import boto3
+    from botocore.config import Config
+    retries = {'max_attempts': max_attempts, 'mode': 'standard'} if max_attempts else None
+    return boto3.client(
+        'bedrock-runtime',
+        region_name=region,
+        config=Config(max_pool_connections=BEDROCK_MAX_WORKERS, retries=retries)
+    )
+
+class ConverseLoopLimitError(Exception):
+    """Raised when an invocation exceeds the agent's iteration, token or time budget"""
+    pass
 
 class ConverseAgent:
-    def __init__(self, model_id, region='us-west-2', system_prompt='You are a helpful assistant.'):
+    def __init__(self, model_id, region='us-west-2', system_prompt='You are a helpful assistant.',
+                 client=None, executor=None):
         self.model_id = model_id
         self.region = region
-        self.client = boto3.client('bedrock-runtime', region_name=self.region)
+        self.client = client or create_bedrock_client(self.region)
+        self.executor = executor or get_default_executor()
         self.system_prompt = system_prompt
         self.messages = []
         self.tools = None
         self.response_output_tags = [] # ['<response>', '</response>']
+        # Tool execution: run all toolUse blocks of a turn concurrently (False = one by one)
+        self.parallel_tool_calls = True
+        self.max_tool_concurrency = 4
+        self.tool_timeout = 60.0 # seconds, used when a tool has no timeout of its own
+        # Budgets for a single invoke; None disables a limit
+        self.max_iterations = 25 # model calls, including tool rounds and continuations
+        self.max_total_tokens = None # sum of Bedrock usage.totalTokens
+        self.max_duration = None # wall-clock seconds
+        # Per-iteration timings and usage of the most recent invoke
+        self.iteration_stats = []
+        # Optional ConverseHistoryManager that keeps self.messages within a token budget
+        self.history = None
+        # Add Bedrock cache points after the system prompt, tool specs and conversation
+        # prefix (requires a model that supports prompt caching)
+        self.prompt_caching = False
+        # Optional BedrockRateLimiter, usually shared by all agents of the process
+        self.rate_limiter = None
+        # Optional BedrockEndpointPool; calls then go to its regions/models instead of self.client
+        self.endpoint_pool = None
 
-    async def invoke_with_prompt(self, prompt):
+    async def invoke_with_prompt(self, prompt, on_text=None):
         content = [
             {
                 'text': prompt
             }
         ]
-        return await self.invoke(content)
+        return await self.invoke(content, on_text)
 
-    async def invoke(self, content):
+    async def invoke(self, content, on_text=None):
+        """
+        Send content to the model and run the tool loop until the model ends its turn.
+        When on_text is given the response is streamed and on_text(delta) is called
+        for every text delta as it arrives. Either way the answer holds the text of
+        all turns, including those before tool calls, separated by a blank line.
+        """
+        if self.messages and self.messages[-1]['role'] == 'user':
+            # A previous invoke stopped after adding tool results; keep roles alternating
+            content = self.messages.pop()['content'] + content
         self.messages.append(
             {
                 "role": "user", 
                 "content": content
             }
         )
-        response = self._get_converse_response()
-        return await self._handle_response(response)
+        return await self._run_loop(on_text)
 
-    def _get_converse_response(self):
+    async def invoke_stream(self, prompt):
         """
-        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-runtime/client/converse.html
+        Async generator version of invoke_with_prompt that yields text deltas
+        as they arrive, including the text of intermediate tool use turns; the
+        deltas add up to what invoke_with_prompt returns
         """
-        response = self.client.converse(
+        queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                await self.invoke_with_prompt(prompt, on_text=queue.put_nowait)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is done:
+                    break
+                yield delta
+            # Surface any exception raised by the agent loop
+            await task
+        finally:
+            task.cancel()
+
+    def _build_converse_request(self):
+        messages = self.messages
+        system = [
+            {
+                "text": self.system_prompt
+            }
+        ]
+        tool_config = self.tools.get_tools()
+        if self.prompt_caching:
+            # Cache points are added to copies so the history itself stays unchanged
+            system = system + [CACHE_POINT]
+            if tool_config['tools']:
+                tool_config = {**tool_config, 'tools': list(tool_config['tools']) + [CACHE_POINT]}
+            if messages:
+                last = messages[-1]
+                messages = messages[:-1] + [{'role': last['role'], 'content': list(last['content']) + [CACHE_POINT]}]
+        return dict(
             modelId=self.model_id,
-            messages=self.messages,
-            system=[
-                {
-                    "text": self.system_prompt
-                }
-            ],
+            messages=messages,
+            system=system,
             inferenceConfig={
                 "maxTokens": 8192,
                 "temperature": 0.7,
             },
-            toolConfig=self.tools.get_tools()
+            toolConfig=tool_config
         )
-        return(response)
-    
-    async def _handle_response(self, response):
-        # Add the response to the conversation history
-        self.messages.append(response['output']['message'])
 
-        # Do we need to do anything else?
-        stop_reason = response['stopReason']
+    async def _run_in_executor(self, func, *args, **kwargs):
+        """Run a blocking boto3 call on the executor so the event loop keeps running"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
 
-        if stop_reason in ['end_turn', 'stop_sequence']:
-            # Safely extract the text from the nested response structure
-            try:
-                message = response.get('output', {}).get('message', {})
-                content = message.get('content', [])
-                text = content[0].get('text', '')
-                if hasattr(self, 'response_output_tags') and len(self.response_output_tags) == 2:
-                    pattern = f"(?s).*{re.escape(self.response_output_tags[0])}(.*?){re.escape(self.response_output_tags[1])}"
-                    match = re.search(pattern, text)
-                    if match:
-                        return match.group(1)
-                return text
-            except (KeyError, IndexError):
-                return ''
-
-        elif stop_reason == 'tool_use':
+    async def _iterate_in_executor(self, iterable):
+        """
+        Consume a blocking iterator on the executor, yielding its items on the event loop.
+        If the consumer stops early (cancelled or the generator closed), the worker stops
+        reading and the iterator is closed if it has a close() method, e.g. an EventStream.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def pump():
             try:
-                # Extract tool use details from response
-                tool_response = []
-                for content_item in response['output']['message']['content']:
-                    if 'toolUse' in content_item:
-                        tool_request = {
-                            "toolUseId": content_item['toolUse']['toolUseId'],
-                            "name": content_item['toolUse']['name'],
-                            "input": content_item['toolUse']['input']
+                for item in iterable:
+                    if stop.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception:
+                # Closing the stream under the reader makes it fail; that is expected
+                if not stop.is_set():
+                    raise
+            finally:
+                if not stop.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = loop.run_in_executor(self.executor, pump)
+        finished = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            finished = True
+        finally:
+            if not finished:
+                stop.set()
+                close = getattr(iterable, 'close', None)
+                if close is not None:
+                    close()
+        # Re-raise any error from the worker thread
+        await future
+
+    async def _call_bedrock(self, func, request, hedge=True, can_retry=None):
+        """
+        Make a Bedrock call with func(client, request), through the endpoint pool
+        and within the rate limiter's limits when they are set. can_retry() tells
+        whether a failed call may still be repeated.
+        """
+        if self.endpoint_pool is None:
+            return await self._call_client(func, self.client, request['modelId'], request, can_retry)
+
+        async def call_endpoint(endpoint, request):
+            # A throttled endpoint is left to the pool, which fails over to another one
+            # instead of backing off on this one
+            return await self._call_client(func, endpoint.client, endpoint.name, request, can_retry,
+                                           max_retries=0)
+
+        return await self.endpoint_pool.call(request, call_endpoint, hedge=hedge, can_retry=can_retry)
+
+    async def _call_client(self, func, client, limiter_key, request, can_retry=None, max_retries=None):
+        if self.rate_limiter is None:
+            return await func(client, request)
+        return await self.rate_limiter.call(
+            limiter_key, estimate_request_tokens(request), partial(func, client, request), can_retry,
+            max_retries
+        )
+
+    async def _get_converse_response(self):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-runtime/client/converse.html
+        """
+        async def converse(client, request):
+            return await self._run_in_executor(client.converse, **request)
+
+        response = await self._call_bedrock(converse, self._build_converse_request())
+        return(response)
+
+    async def _get_converse_stream_response(self, on_text):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-runtime/client/converse_stream.html
+
+        Calls on_text for each text delta and returns the streamed events
+        reassembled into the same shape as a converse response.
+        """
+        emitted = False
+
+        def emit(text):
+            nonlocal emitted
+            emitted = True
+            on_text(text)
+
+        async def converse_stream(client, request):
+            response = await self._run_in_executor(client.converse_stream, **request)
+            return await self._assemble_stream(response['stream'], emit)
+
+        # Streamed text is passed on as it arrives, so the call is never duplicated,
+        # and it is only retried (e.g. when throttled mid-stream) if no text was passed on yet
+        return await self._call_bedrock(converse_stream, self._build_converse_request(), hedge=False,
+                                        can_retry=lambda: not emitted)
+
+    async def _assemble_stream(self, stream, on_text):
+        role = 'assistant'
+        blocks = {} # contentBlockIndex -> partially built content block
+        stop_reason = None
+        usage = {}
+        metrics = {}
+
+        # aclosing stops the reader thread right away when this is cancelled or raises
+        async with contextlib.aclosing(self._iterate_in_executor(stream)) as events:
+            async for event in events:
+                if 'messageStart' in event:
+                    role = event['messageStart'].get('role', role)
+                elif 'contentBlockStart' in event:
+                    start = event['contentBlockStart']
+                    if 'toolUse' in start.get('start', {}):
+                        tool_use = start['start']['toolUse']
+                        blocks[start['contentBlockIndex']] = {
+                            'toolUse': {
+                                'toolUseId': tool_use['toolUseId'],
+                                'name': tool_use['name'],
+                                'input': ''
+                            }
                         }
-                        
-                        tool_result = await self.tools.execute_tool(tool_request)
-                        tool_response.append({'toolResult': tool_result})
-                
-                return await self.invoke(tool_response)
-                
-            except KeyError as e:
-                raise ValueError(f"Missing required tool use field: {e}")
-            except Exception as e:
-                raise ValueError(f"Failed to execute tool: {e}")
+                elif 'contentBlockDelta' in event:
+                    index = event['contentBlockDelta']['contentBlockIndex']
+                    delta = event['contentBlockDelta']['delta']
+                    if 'text' in delta:
+                        block = blocks.setdefault(index, {'text': ''})
+                        block['text'] += delta['text']
+                        on_text(delta['text'])
+                    elif 'toolUse' in delta:
+                        # Tool input arrives as fragments of a JSON document
+                        blocks[index]['toolUse']['input'] += delta['toolUse'].get('input', '')
+                elif 'messageStop' in event:
+                    stop_reason = event['messageStop']['stopReason']
+                elif 'metadata' in event:
+                    usage = event['metadata'].get('usage', {})
+                    metrics = event['metadata'].get('metrics', {})
+                else:
+                    for event_type in event:
+                        if event_type.endswith('Exception'):
+                            raise ValueError(f"Bedrock stream error {event_type}: {event[event_type]}")
+
+        content = []
+        for index in sorted(blocks):
+            block = blocks[index]
+            if 'toolUse' in block:
+                raw_input = block['toolUse']['input']
+                block['toolUse']['input'] = json.loads(raw_input) if raw_input else {}
+            content.append(block)
+
+        return {
+            'output': {
+                'message': {
+                    'role': role,
+                    'content': content
+                }
+            },
+            'stopReason': stop_reason,
+            'usage': usage,
+            'metrics': metrics
+        }
+    
+    async def _run_loop(self, on_text=None):
+        """
+        Call the model until it ends its turn, executing requested tools and
+        continuing after max_tokens, within the agent's loop budgets.
+        Returns the final text, stitched together across max_tokens continuations.
+        """
+        with get_tracer().span('agent.invoke', model_id=self.model_id) as span:
+            text = await self._run_iterations(on_text)
+            span.set_attributes({
+                'iterations': len(self.iteration_stats),
+                'input_tokens': sum(stats['input_tokens'] for stats in self.iteration_stats),
+                'output_tokens': sum(stats['output_tokens'] for stats in self.iteration_stats)
+            })
+            return text
+
+    async def _run_iterations(self, on_text):
+        self.iteration_stats = []
+        started = time.perf_counter()
+        total_tokens = 0
+        turn_texts = []  # text of finished tool use turns
+        text_parts = []  # text of the current turn, in parts when continued after max_tokens
+        separate = False  # a streamed turn had text; separate the next text from it
+
+        def emit(text):
+            nonlocal separate
+            if separate:
+                on_text(TURN_SEPARATOR)
+                separate = False
+            on_text(text)
+
+        while True:
+            iteration = len(self.iteration_stats) + 1
+            timeout = self._check_budget(iteration, total_tokens, started)
+            if self.history:
+                self.messages = await self.history.compact(self.messages)
+
+            model_started = time.perf_counter()
+            with get_tracer().span('bedrock.converse', model_id=self.model_id, iteration=iteration,
+                                   streaming=on_text is not None) as span:
+                if on_text is None:
+                    request = self._get_converse_response()
+                else:
+                    request = self._get_converse_stream_response(emit)
+                try:
+                    response = await asyncio.wait_for(request, timeout)
+                except asyncio.TimeoutError:
+                    raise ConverseLoopLimitError(f"Exceeded max_duration of {self.max_duration} seconds")
+                span.set_attributes(self._trace_attributes(response))
+
+            usage = response.get('usage', {})
+            total_tokens += usage.get('totalTokens', 0)
+            stop_reason = response['stopReason']
+            stats = {
+                'iteration': iteration,
+                'stop_reason': stop_reason,
+                'model_seconds': time.perf_counter() - model_started,
+                'tool_seconds': 0.0,
+                'tool_calls': 0,
+                'input_tokens': usage.get('inputTokens', 0),
+                'output_tokens': usage.get('outputTokens', 0),
+                'cache_read_tokens': usage.get('cacheReadInputTokens', 0),
+                'cache_write_tokens': usage.get('cacheWriteInputTokens', 0)
+            }
+            self.iteration_stats.append(stats)
+
+            # Add the response to the conversation history
+            self.messages.append(response['output']['message'])
+            if self.history:
+                self.history.record_usage(self.messages, usage)
 
-        elif stop_reason == 'max_tokens':
-            # Hit token limit (this is one way to handle it.)
-            await self.invoke_with_prompt('Please continue.')
+            if stop_reason in ['end_turn', 'stop_sequence']:
+                text_parts.append(self._get_response_text(response))
+                turn_texts.append(''.join(text_parts))
+                return self._apply_output_tags(TURN_SEPARATOR.join(text for text in turn_texts if text))
 
-        else:
-            raise ValueError(f"Unknown stop reason: {stop_reason}")
+            elif stop_reason == 'tool_use':
+                # Text before a tool call (e.g. "Let me check.") is part of the answer,
+                # as it has been streamed already
+                text_parts.append(self._get_response_text(response))
+                turn_texts.append(''.join(text_parts))
+                text_parts = []
+                separate = separate or bool(turn_texts[-1])
+                tool_started = time.perf_counter()
+                tool_requests = self._get_tool_requests(response)
+                if timeout is not None:
+                    # The model call used part of the time left
+                    timeout = max(0, self.max_duration - (tool_started - started))
+                try:
+                    tool_response = await asyncio.wait_for(self._execute_tools(tool_requests), timeout)
+                except asyncio.TimeoutError:
+                    # Answer every toolUse so the history stays valid for the next invoke
+                    self.messages.append({'role': 'user', 'content': [
+                        {'toolResult': {
+                            'toolUseId': tool_request['toolUseId'],
+                            'content': [{'text': 'Tool call cancelled: the agent ran out of time'}],
+                            'status': 'error'
+                        }}
+                        for tool_request in tool_requests
+                    ]})
+                    raise ConverseLoopLimitError(f"Exceeded max_duration of {self.max_duration} seconds")
+                stats['tool_seconds'] = time.perf_counter() - tool_started
+                stats['tool_calls'] = len(tool_response)
+                self.messages.append({'role': 'user', 'content': tool_response})
 
+            elif stop_reason == 'max_tokens':
+                # Hit token limit: ask the model to continue and stitch the parts together
+                text_parts.append(self._get_response_text(response))
+                self.messages.append({'role': 'user', 'content': [{'text': 'Please continue.'}]})
+
+            else:
+                raise ValueError(f"Unknown stop reason: {stop_reason}")
+
+    def _trace_attributes(self, response):
+        """Bedrock usage and metrics of a response, as span attributes"""
+        usage = response.get('usage', {})
+        return {
+            'stop_reason': response.get('stopReason'),
+            'input_tokens': usage.get('inputTokens', 0),
+            'output_tokens': usage.get('outputTokens', 0),
+            'cache_read_tokens': usage.get('cacheReadInputTokens', 0),
+            'cache_write_tokens': usage.get('cacheWriteInputTokens', 0),
+            'bedrock_latency_ms': response.get('metrics', {}).get('latencyMs')
+        }
+
+    async def summarize(self, transcript):
+        """Summarize a conversation transcript, e.g. as a ConverseHistoryManager summarizer"""
+        async def converse(client, request):
+            return await self._run_in_executor(client.converse, **request)
+
+        response = await self._call_bedrock(converse, dict(
+            modelId=self.model_id,
+            messages=[{'role': 'user', 'content': [{'text': transcript}]}],
+            system=[{
+                'text': 'Summarize this conversation in a few sentences. Keep facts, numbers '
+                        'and tool results the user may refer back to.'
+            }],
+            inferenceConfig={'maxTokens': 1024, 'temperature': 0}
+        ))
+        return self._get_response_text(response)
+
+    def _check_budget(self, iteration, total_tokens, started):
+        """Raise if a loop budget is exhausted, otherwise return the time left (or None)"""
+        if self.max_iterations is not None and iteration > self.max_iterations:
+            raise ConverseLoopLimitError(f"Exceeded max_iterations of {self.max_iterations}")
+        if self.max_total_tokens is not None and total_tokens >= self.max_total_tokens:
+            raise ConverseLoopLimitError(
+                f"Exceeded max_total_tokens of {self.max_total_tokens} ({total_tokens} used)"
+            )
+        if self.max_duration is None:
+            return None
+        remaining = self.max_duration - (time.perf_counter() - started)
+        if remaining <= 0:
+            raise ConverseLoopLimitError(f"Exceeded max_duration of {self.max_duration} seconds")
+        return remaining
+
+    def _get_response_text(self, response):
+        # Safely extract the text from the nested response structure
+        content = response.get('output', {}).get('message', {}).get('content', [])
+        return ''.join(item['text'] for item in content if 'text' in item)
+
+    def _apply_output_tags(self, text):
+        if len(self.response_output_tags) == 2:
+            pattern = f"(?s).*{re.escape(self.response_output_tags[0])}(.*?){re.escape(self.response_output_tags[1])}"
+            match = re.search(pattern, text)
+            if match:
+                return match.group(1)
+        return text
+
+    def _get_tool_requests(self, response):
+        """Extract tool use details from a response"""
+        try:
+            return [
+                {
+                    "toolUseId": content_item['toolUse']['toolUseId'],
+                    "name": content_item['toolUse']['name'],
+                    "input": content_item['toolUse']['input']
+                }
+                for content_item in response['output']['message']['content']
+                if 'toolUse' in content_item
+            ]
+        except KeyError as e:
+            raise ValueError(f"Missing required tool use field: {e}")
+
+    async def _execute_tools(self, tool_requests):
+        """
+        Execute the tool requests of one turn and return their toolResult blocks.
+        Results keep the order of tool_requests, which is the toolUseId order
+        the model expects, and a failing or timed out tool only fails its own result.
+        """
+        if not self.parallel_tool_calls or len(tool_requests) < 2:
+            return [
+                {'toolResult': await self._execute_tool(tool_request)}
+                for tool_request in tool_requests
+            ]
+
+        semaphore = asyncio.Semaphore(max(1, self.max_tool_concurrency))
+
+        async def run(tool_request):
+            async with semaphore:
+                return await self._execute_tool(tool_request)
+
+        tool_results = await asyncio.gather(*(run(tool_request) for tool_request in tool_requests))
+        return [{'toolResult': tool_result} for tool_result in tool_results]
+
+    async def _execute_tool(self, tool_request):
+        """Execute a single tool request, turning timeouts and errors into an error toolResult"""
+        timeout = self.tools.get_tool_timeout(tool_request['name'])
+        if timeout is None:
+            timeout = self.tool_timeout
+        with get_tracer().span('tool.execute', tool=tool_request['name']) as span:
+            try:
+                tool_result = await asyncio.wait_for(self.tools.execute_tool(tool_request), timeout)
+                span.set_attribute('status', tool_result['status'])
+                return tool_result
+            except asyncio.TimeoutError:
+                error = f"Tool timed out after {timeout} seconds"
+            except Exception as e:
+                error = f"Error executing tool: {str(e)}"
+            span.set_attribute('status', 'error')
+        return {
+            'toolUseId': tool_request['toolUseId'],
+            'content': [{
+                'text': error
+            }],
+            'status': 'error'
+        }
@@ -0,0 +1,147 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import json
+
+class ConverseHistoryManager:
+    """
+    Keeps a Converse message history within a token budget.
+
+    The size of the history is taken from the usage Bedrock reports for each
+    call, plus a character based estimate for messages added since. When the
+    budget is exceeded, bulky toolResult payloads are shortened first, then
+    the oldest turns are dropped (or summarized). A turn starts at a user
+    message that is not a tool result, so a toolUse is never separated from
+    its toolResult.
+    """
+    def __init__(self, max_tokens: int = 50000, target_ratio: float = 0.75, keep_recent_turns: int = 2,
+                 max_tool_result_chars: int = 2000,
+                 summarizer: Optional[Callable[[str], Awaitable[str]]] = None):
+        self.max_tokens = max_tokens
+        self.target_tokens = int(max_tokens * target_ratio)
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.max_tool_result_chars = max_tool_result_chars
+        self.summarizer = summarizer  # async (transcript) -> summary text
+        self._tokens_per_char = 0.25  # calibrated from Bedrock usage
+        self._measured = None  # (message count, tokens) from the last Bedrock usage
+        self._calibration = (0, 0)  # (tokens, chars) of messages added between two measurements
+        self.compactions = 0
+
+    def record_usage(self, messages: List[Dict], usage: Dict[str, Any]):
+        """
+        Record Bedrock usage for a call whose response is the last of messages.
+        Input (including cached input) plus output tokens is then the size of the whole history.
+
+        The usage also covers the system prompt and tool specs, so the tokens per
+        character are calibrated on the growth between two measurements only.
+        """
+        tokens = sum(
+            usage.get(key, 0)
+            for key in ('inputTokens', 'cacheReadInputTokens', 'cacheWriteInputTokens', 'outputTokens')
+        )
+        if not tokens:
+            return
+        if self._measured and self._measured[0] < len(messages):
+            count, measured_tokens = self._measured
+            added_chars = sum(self._message_chars(message) for message in messages[count:])
+            if added_chars and tokens > measured_tokens:
+                calibration_tokens, calibration_chars = self._calibration
+                self._calibration = (calibration_tokens + tokens - measured_tokens,
+                                     calibration_chars + added_chars)
+                self._tokens_per_char = self._calibration[0] / self._calibration[1]
+        self._measured = (len(messages), tokens)
+
+    def estimate_tokens(self, messages: List[Dict]) -> int:
+        """Estimate the token count of messages, anchored on the last measured usage"""
+        if self._measured and self._measured[0] <= len(messages):
+            count, tokens = self._measured
+            return tokens + self._estimate(messages[count:])
+        return self._estimate(messages)
+
+    async def compact(self, messages: List[Dict]) -> List[Dict]:
+        """Return messages, compacted to the target budget if they exceed max_tokens"""
+        if self.estimate_tokens(messages) <= self.max_tokens:
+            return messages
+
+        self.compactions += 1
+        self._measured = None
+        boundaries = self._turn_boundaries(messages)
+        recent_start = boundaries[-self.keep_recent_turns] if len(boundaries) >= self.keep_recent_turns else 0
+
+        # 1. Shorten tool results outside the most recent turns
+        messages = [
+            self._shrink_tool_results(message) if index < recent_start else message
+            for index, message in enumerate(messages)
+        ]
+        if self._estimate(messages) <= self.target_tokens:
+            return messages
+
+        # 2. Drop the oldest turns until the rest fits
+        cut = 0
+        for boundary in boundaries[1:len(boundaries) - self.keep_recent_turns + 1]:
+            cut = boundary
+            if self._estimate(messages[cut:]) <= self.target_tokens:
+                break
+        if cut:
+            dropped, messages = messages[:cut], messages[cut:]
+            if self.summarizer:
+                summary = await self.summarizer(self._transcript(dropped))
+                first = messages[0]
+                messages[0] = {
+                    'role': first['role'],
+                    'content': [{'text': f"Summary of the earlier conversation:\n{summary}"}] + first['content']
+                }
+        if self._estimate(messages) <= self.target_tokens:
+            return messages
+
+        # 3. Still too large: shorten the recent tool results as well
+        return [self._shrink_tool_results(message) for message in messages]
+
+    def _estimate(self, messages: List[Dict]) -> int:
+        return int(sum(self._message_chars(message) for message in messages) * self._tokens_per_char)
+
+    def _message_chars(self, message: Dict) -> int:
+        return sum(len(json.dumps(block, default=str)) for block in message.get('content', []))
+
+    def _turn_boundaries(self, messages: List[Dict]) -> List[int]:
+        """Indexes of user messages that start a turn, i.e. are not tool results"""
+        return [
+            index for index, message in enumerate(messages)
+            if message['role'] == 'user'
+            and not any('toolResult' in block for block in message['content'])
+        ]
+
+    def _shrink_tool_results(self, message: Dict) -> Dict:
+        if not any('toolResult' in block for block in message['content']):
+            return message
+        content = []
+        for block in message['content']:
+            if 'toolResult' in block:
+                tool_result = dict(block['toolResult'])
+                tool_result['content'] = [self._shrink_block(item) for item in tool_result.get('content', [])]
+                block = {'toolResult': tool_result}
+            content.append(block)
+        return {'role': message['role'], 'content': content}
+
+    def _shrink_block(self, block: Dict) -> Dict:
+        if 'text' in block:
+            text = block['text']
+        elif 'json' in block:
+            text = json.dumps(block['json'])
+        else:
+            return block
+        if len(text) <= self.max_tool_result_chars:
+            return block
+        return {'text': f"{text[:self.max_tool_result_chars]}... [truncated {len(text) - self.max_tool_result_chars} chars]"}
+
+    def _transcript(self, messages: List[Dict]) -> str:
+        """Render messages as plain text, so they can be summarized without a toolConfig"""
+        lines = []
+        for message in messages:
+            for block in message['content']:
+                if 'text' in block:
+                    lines.append(f"{message['role']}: {block['text']}")
+                elif 'toolUse' in block:
+                    lines.append(f"{message['role']} called {block['toolUse']['name']}({json.dumps(block['toolUse']['input'])})")
+                elif 'toolResult' in block:
+                    result = [self._shrink_block(item) for item in block['toolResult'].get('content', [])]
+                    lines.append(f"tool result: {json.dumps(result)}")
+        return '\n'.join(lines)
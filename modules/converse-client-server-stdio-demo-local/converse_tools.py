@@ -1,56 +1,201 @@
-from typing import Any, Dict, List, Callable
+from collections import OrderedDict
+from typing import Any, Dict, List, Callable, Optional, Tuple
+import base64
+import copy
 import inspect
+import itertools
 import json
+import time
+from tracing import current_span
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError("Tool specifications are read-only; copy them before modifying")
+
+# The tool specification is shared between calls, so it is built from dict and list
+# subclasses that reject modification but still pass botocore's type validation.
+# A copy (shallow or deep) is the caller's own, mutable, copy; pickling keeps them read-only.
+class FrozenDict(dict):
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        # The default reduces to setting items one by one, which is rejected
+        return FrozenDict, (dict(self),)
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+    __iadd__ = __imul__ = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+def freeze(value):
+    """Recursively convert dicts and lists to their read-only versions"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+# Image formats a Converse image block accepts
+IMAGE_FORMATS = {'image/png': 'png', 'image/jpeg': 'jpeg', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+READ_TOOL_RESULT = 'read_tool_result'
+
+def to_content_blocks(result: Any) -> Tuple[List[Dict], bool]:
+    """
+    Convert a tool result to Converse toolResult content blocks, returning the
+    blocks and whether the result is an error. MCP CallToolResults map their
+    structured content to a json block, or each content item to a text or
+    image block; other values become json (dicts and lists) or text.
+    """
+    if hasattr(result, 'content') and hasattr(result, 'isError'):
+        if result.structuredContent is not None:
+            # FastMCP also serializes structured content as text; the json block alone is enough
+            return [{'json': result.structuredContent}], bool(result.isError)
+        blocks = [block for item in result.content for block in _mcp_content_block(item)]
+        return blocks or [{'text': ''}], bool(result.isError)
+    if isinstance(result, dict):
+        return [{'json': result}], False
+    if isinstance(result, (list, tuple)):
+        return [{'json': {'result': list(result)}}], False
+    return [{'text': str(result)}], False
+
+def _mcp_content_block(item) -> List[Dict]:
+    if item.type == 'text':
+        return [{'text': item.text}]
+    if item.type == 'image' and item.mimeType in IMAGE_FORMATS:
+        return [{'image': {'format': IMAGE_FORMATS[item.mimeType], 'source': {'bytes': base64.b64decode(item.data)}}}]
+    if item.type == 'resource' and hasattr(item.resource, 'text'):
+        return [{'text': item.resource.text}]
+    if item.type == 'resource_link':
+        return [{'text': f"Resource: {item.uri}"}]
+    return [{'text': f"[{item.type} content not shown]"}]
+
+def content_size(content: List[Dict]) -> int:
+    """Characters the model reads for text and json blocks"""
+    size = 0
+    for block in content:
+        if 'text' in block:
+            size += len(block['text'])
+        elif 'json' in block:
+            size += len(json.dumps(block['json'], separators=(',', ':'), default=str))
+    return size
 
 class ConverseToolManager:
-    def __init__(self):
+    def __init__(self, cache_size: int = 256, max_result_chars: Optional[int] = 20000,
+                 spill_size: int = 64):
         self._tools = {}
         self._name_mapping = {}  # Maps sanitized names to original names
+        self._tool_specs = None  # Memoized result of get_tools()
+        self.version = 0  # Incremented whenever the registered tools change
+        # LRU cache of results of cacheable tools:
+        # (name, canonical input) -> (expires, content, result_id of a truncated result or None)
+        self.cache_size = cache_size
+        self._result_cache = OrderedDict()
+        self._cache_stats = {}  # name -> {'hits': n, 'misses': n}
+        # Results larger than max_result_chars are replaced with a preview; the full
+        # text is kept for the read_tool_result tool, for the last spill_size results
+        # and for as long as a cached preview refers to it
+        self.max_result_chars = max_result_chars
+        self.spill_size = spill_size
+        self._spilled = OrderedDict()  # result id -> full result text
+        self._spill_ids = itertools.count(1)
+        if max_result_chars is not None:
+            # Registered up front: adding it later would change the tool config
+            # mid-conversation and invalidate Bedrock's prompt cache
+            self._register_read_tool_result()
     
     def _sanitize_name(self, name: str) -> str:
         """Convert hyphenated names to underscore format"""
         return name.replace('-', '_')
     
-    def register_tool(self, name: str, func: Callable, description: str, input_schema: Dict):
+    @staticmethod
+    def is_cacheable(annotations: Optional[Dict]) -> bool:
+        """
+        Whether MCP tool annotations describe a deterministic tool: read-only and
+        not interacting with an open world (openWorldHint defaults to true)
+        """
+        annotations = annotations or {}
+        return annotations.get('readOnlyHint') is True and annotations.get('openWorldHint') is False
+
+    def register_tool(self, name: str, func: Callable, description: str, input_schema: Dict,
+                      timeout: Optional[float] = None, cacheable: bool = False,
+                      cache_ttl: Optional[float] = None):
         """
-        Register a new tool with the system, sanitizing the name for Bedrock compatibility
+        Register a new tool with the system, sanitizing the name for Bedrock compatibility.
+        timeout (seconds) overrides the agent's default tool timeout for this tool.
+        Results of cacheable tools are reused for identical input, for cache_ttl
+        seconds (None = until evicted).
         """
         sanitized_name = self._sanitize_name(name)
         print(f"Registering tool - Original name: {name}, Sanitized name: {sanitized_name}")
+        self._add_tool(sanitized_name, name, func, description, input_schema, timeout, cacheable, cache_ttl)
+
+    def _add_tool(self, sanitized_name: str, name: str, func: Callable, description: str, input_schema: Dict,
+                  timeout: Optional[float] = None, cacheable: bool = False, cache_ttl: Optional[float] = None):
         self._name_mapping[sanitized_name] = name
         self._tools[sanitized_name] = {
             'function': func,
             'description': description,
-            'input_schema': input_schema,
-            'original_name': name
+            'input_schema': self._normalize_schema(input_schema),
+            'original_name': name,
+            'timeout': timeout,
+            'cacheable': cacheable,
+            'cache_ttl': cache_ttl
         }
+        self._evict_results(sanitized_name)
+        self._invalidate()
+
+    def _normalize_schema(self, input_schema: Dict) -> Dict:
+        """Return a copy of the input schema with the structure Bedrock expects"""
+        input_schema = copy.deepcopy(input_schema)
+        if 'json' not in input_schema:
+            input_schema = {'json': input_schema}
+        input_schema['json'].setdefault('type', 'object')
+        input_schema['json'].setdefault('properties', {})
+        input_schema['json'].setdefault('required', [])
+        return input_schema
+
+    def _invalidate(self):
+        self._tool_specs = None
+        self.version += 1
 
     def get_tools(self) -> Dict[str, List[Dict]]:
         """
-        Generate the tools specification using sanitized names
+        Return the tools specification using sanitized names.
+        The specification is built once per version and is read-only.
         """
-        tool_specs = []
-        for sanitized_name, tool in self._tools.items():
-            # Ensure input schema has the correct structure
-            input_schema = tool['input_schema']
-            if 'json' not in input_schema:
-                input_schema = {'json': input_schema}
-            if 'type' not in input_schema['json']:
-                input_schema['json']['type'] = 'object'
-            if 'properties' not in input_schema['json']:
-                input_schema['json']['properties'] = {}
-            if 'required' not in input_schema['json']:
-                input_schema['json']['required'] = []
-
-            tool_specs.append({
-                'toolSpec': {
-                    'name': sanitized_name,  # Use sanitized name for Bedrock
-                    'description': tool['description'],
-                    'inputSchema': input_schema
-                }
+        if self._tool_specs is None:
+            self._tool_specs = freeze({
+                'tools': [
+                    {
+                        'toolSpec': {
+                            'name': sanitized_name,  # Use sanitized name for Bedrock
+                            'description': tool['description'],
+                            'inputSchema': tool['input_schema']
+                        }
+                    }
+                    for sanitized_name, tool in self._tools.items()
+                ]
             })
-        
-        return {'tools': tool_specs}
+        return self._tool_specs
+
+    def get_tool_timeout(self, sanitized_name: str) -> Optional[float]:
+        """Return the timeout registered for a tool, or None to use the caller's default"""
+        tool = self._tools.get(sanitized_name)
+        return tool['timeout'] if tool else None
 
     async def execute_tool(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -59,23 +204,33 @@ class ConverseToolManager:
         tool_use_id = payload['toolUseId']
         sanitized_name = payload['name']
         tool_input = payload['input']
-        
-        print(f"Executing tool - Requested name: {sanitized_name}")
-        print(f"Available tools: {list(self._tools.keys())}")
 
         if sanitized_name not in self._tools:
             raise ValueError(f"Unknown tool: {sanitized_name}")
+        tool = self._tools[sanitized_name]
+        cache_key = self._cache_key(sanitized_name, tool_input) if tool['cacheable'] else None
+        if cache_key:
+            content = self._get_cached_result(cache_key)
+            current_span().set_attribute('cache_hit', content is not None)
+            if content is not None:
+                return {
+                    'toolUseId': tool_use_id,
+                    'content': content,
+                    'status': 'success'
+                }
         try:
-            tool_func = self._tools[sanitized_name]['function']
+            tool_func = tool['function']
             # Use original name when calling the actual function
-            original_name = self._tools[sanitized_name]['original_name']
+            original_name = tool['original_name']
             result = await tool_func(original_name, tool_input)
+            content, is_error = to_content_blocks(result)
+            content, result_id = self._cap_size(sanitized_name, content)
+            if cache_key and not is_error:
+                self._store_result(cache_key, content, tool['cache_ttl'], result_id)
             return {
                 'toolUseId': tool_use_id,
-                'content': [{
-                    'text': str(result)
-                }],
-                'status': 'success'
+                'content': content,
+                'status': 'error' if is_error else 'success'
             }
         except Exception as e:
             return {
@@ -86,7 +241,135 @@ class ConverseToolManager:
                 'status': 'error'
             }
 
+    # Oversized results
+
+    def _cap_size(self, sanitized_name: str, content: List[Dict]) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Replace text and json blocks larger than max_result_chars with a preview.
+        Returns the content and the result_id of the full text, if it was truncated.
+        """
+        if self.max_result_chars is None or content_size(content) <= self.max_result_chars:
+            return content, None
+        text = '\n'.join(
+            block['text'] if 'text' in block else json.dumps(block['json'], separators=(',', ':'), default=str)
+            for block in content if 'text' in block or 'json' in block
+        )
+        result_id = f"{sanitized_name}-{next(self._spill_ids)}"
+        self._spilled[result_id] = text
+        self._evict_spilled(keep=result_id)
+        preview = text[:self.max_result_chars // 2]
+        return [block for block in content if 'image' in block] + [{
+            'text': f"{preview}\n[Result truncated: showing {len(preview)} of {len(text)} characters. "
+                    f"Call {READ_TOOL_RESULT} with result_id \"{result_id}\" and offset {len(preview)} "
+                    f"to read more.]"
+        }], result_id
+
+    def _evict_spilled(self, keep: str):
+        """Drop the oldest full results beyond spill_size, except those cached previews refer to"""
+        if len(self._spilled) <= self.spill_size:
+            return
+        now = time.monotonic()
+        pinned = {keep} | {
+            result_id for expires, _, result_id in self._result_cache.values()
+            if result_id and (expires is None or expires > now)
+        }
+        for result_id in [result_id for result_id in self._spilled if result_id not in pinned]:
+            if len(self._spilled) <= self.spill_size:
+                break
+            del self._spilled[result_id]
+
+    def _register_read_tool_result(self):
+        if READ_TOOL_RESULT in self._tools:
+            return
+        # Built in, so registered without the log line (batch mode writes results to stdout)
+        self._add_tool(
+            READ_TOOL_RESULT,
+            READ_TOOL_RESULT,
+            self._read_tool_result,
+            'Read part of a tool result that was too large to return at once',
+            {
+                'type': 'object',
+                'properties': {
+                    'result_id': {'type': 'string', 'description': 'The result_id given in the truncated result'},
+                    'offset': {'type': 'integer', 'description': 'Character offset to start reading at'},
+                    'length': {'type': 'integer', 'description': 'Number of characters to read'}
+                },
+                'required': ['result_id']
+            }
+        )
+
+    async def _read_tool_result(self, name: str, tool_input: Dict[str, Any]) -> str:
+        result_id = tool_input['result_id']
+        if result_id not in self._spilled:
+            raise ValueError(f"Unknown or expired result_id: {result_id}")
+        text = self._spilled[result_id]
+        offset = max(0, int(tool_input.get('offset', 0)))
+        # Pages stay below max_result_chars so they are not truncated again
+        page_size = self.max_result_chars // 2
+        length = min(int(tool_input.get('length', page_size)), page_size)
+        end = min(len(text), offset + max(1, length))
+        remaining = f" Continue at offset {end}." if end < len(text) else ""
+        return f"{text[offset:end]}\n[Characters {offset}-{end} of {len(text)}.{remaining}]"
+
+    def get_spilled_result(self, result_id: str) -> Optional[str]:
+        """The full text of a truncated result, e.g. to show it to the user"""
+        return self._spilled.get(result_id)
+
+    # Result cache
+
+    def _cache_key(self, sanitized_name: str, tool_input: Dict[str, Any]):
+        try:
+            canonical_input = json.dumps(tool_input, sort_keys=True, separators=(',', ':'))
+        except TypeError:
+            return None
+        return (sanitized_name, canonical_input)
+
+    def _get_cached_result(self, cache_key) -> Optional[List[Dict]]:
+        stats = self._cache_stats.setdefault(cache_key[0], {'hits': 0, 'misses': 0})
+        entry = self._result_cache.get(cache_key)
+        if entry is not None:
+            expires, content, _ = entry
+            if expires is None or expires > time.monotonic():
+                self._result_cache.move_to_end(cache_key)
+                stats['hits'] += 1
+                return content
+            del self._result_cache[cache_key]
+        stats['misses'] += 1
+        return None
+
+    def _store_result(self, cache_key, content: List[Dict], ttl: Optional[float],
+                      result_id: Optional[str] = None):
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._result_cache[cache_key] = (expires, content, result_id)
+        self._result_cache.move_to_end(cache_key)
+        while len(self._result_cache) > self.cache_size:
+            self._result_cache.popitem(last=False)
+
+    def _evict_results(self, sanitized_name: Optional[str] = None):
+        """Drop cached results of one tool, or of all tools"""
+        if sanitized_name is None:
+            self._result_cache.clear()
+            return
+        for cache_key in [key for key in self._result_cache if key[0] == sanitized_name]:
+            del self._result_cache[cache_key]
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Result cache hit/miss counters, in total and per tool"""
+        return {
+            'hits': sum(stats['hits'] for stats in self._cache_stats.values()),
+            'misses': sum(stats['misses'] for stats in self._cache_stats.values()),
+            'size': len(self._result_cache),
+            'tools': {name: dict(stats) for name, stats in self._cache_stats.items()}
+        }
+
     def clear_tools(self):
         """Clear all registered tools"""
         self._tools.clear()
+        self._name_mapping.clear()
+        self._evict_results()
+        self._invalidate()
+        if self.max_result_chars is not None:
+            # Truncated results in the conversation still point to read_tool_result
+            self._register_read_tool_result()
+
     
\ No newline at end of file
@@ -1,16 +1,40 @@
-from mcp import ClientSession, StdioServerParameters
+from collections import OrderedDict
+from mcp import ClientSession, StdioServerParameters, types
+from mcp.client.sse import sse_client
 from mcp.client.stdio import stdio_client
-from typing import Any, List
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from pydantic import AnyUrl
+from tracing import get_tracer
+from typing import Any, List, Union
 import asyncio
-import json
 
 class MCPClient:
-    def __init__(self, server_params: StdioServerParameters):
+    def __init__(self, server_params: Union[StdioServerParameters, str], resource_cache_size: int = 128):
+        """
+        server_params is either stdio parameters for a local server process, or the
+        URL of a remote server (URLs ending in /sse use SSE, others streamable HTTP).
+        Up to resource_cache_size resources are cached, if the server supports
+        resource subscriptions to keep them fresh.
+        """
         self.server_params = server_params
         self.session = None
         self._client = None
         self._resource_update_callbacks = []
-        self._notification_task = None
+        self._tools_changed_callbacks = []
+        self._notification_tasks = set()
+        self._tools_cache = None  # Formatted tool catalog, refreshed on tools/list_changed
+        self._tools_refresh = None  # In-flight refresh of the tool catalog
+        self._tools_refresh_version = None  # _tools_version the in-flight refresh started at
+        self._tools_version = 0  # Number of tools/list_changed notifications received
+        self.resource_cache_size = resource_cache_size
+        self._resource_cache = OrderedDict()  # uri -> ReadResourceResult, in LRU order
+        self._resource_reads = {}  # uri -> in-flight read task
+        self._resource_versions = {}  # uri -> number of updates received, to detect stale reads
+        self._subscribed = set()
+        self._unsubscribes = set()  # In-flight unsubscribe requests
+        self._subscriptions_supported = None  # Unknown until the first subscribe
+        self._resource_stats = {'hits': 0, 'misses': 0}
         
     async def __aenter__(self):
         """Async context manager entry"""
@@ -19,61 +43,128 @@ class MCPClient:
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self._notification_task:
-            self._notification_task.cancel()
-            try:
-                await self._notification_task
-            except asyncio.CancelledError:
-                pass
+        # Let unsubscribe requests finish; a request cancelled mid-flight leaves its
+        # response with nowhere to go while the transport shuts down
+        if self._unsubscribes:
+            await asyncio.wait(self._unsubscribes, timeout=1)
+        tasks = list(self._notification_tasks) + list(self._unsubscribes) + list(self._resource_reads.values())
+        if self._tools_refresh:
+            tasks.append(self._tools_refresh)
+        for task in tasks:
+            task.cancel()
+        # Errors of notification handling must not prevent closing the connection
+        await asyncio.gather(*tasks, return_exceptions=True)
         if self.session:
             await self.session.__aexit__(exc_type, exc_val, exc_tb)
         if self._client:
             await self._client.__aexit__(exc_type, exc_val, exc_tb)
 
-    async def _handle_incoming_messages(self):
-        """Process incoming messages from the session"""
-        async for message in self.session.incoming_messages:
-            if isinstance(message, Exception):
-                print(f"Error in message handling: {message}")
-                continue
-                
-            if hasattr(message, 'method') and message.method == "resource/updated":
-                uri = message.params.uri
-                for callback in self._resource_update_callbacks:
-                    try:
-                        await callback(uri)
-                    except Exception as e:
-                        print(f"Error in resource update callback: {e}")
+    async def _handle_incoming_message(self, message):
+        """
+        Process incoming messages from the session. This runs inside the session's
+        receive loop, so the actual work is done in separate tasks.
+        """
+        if isinstance(message, Exception):
+            print(f"Error in message handling: {message}")
+            return
+
+        notification = getattr(message, 'root', None)
+        method = getattr(notification, 'method', None)
+        if method == "notifications/resources/updated":
+            uri = str(notification.params.uri)
+            # Invalidate before any callback runs, so callbacks re-reading it get fresh data
+            self._invalidate_resource(uri)
+            self._spawn(self._notify_resource_update(uri))
+        elif method == "notifications/tools/list_changed":
+            # Invalidate now, so no caller gets the old catalog from here on
+            self._tools_version += 1
+            self._tools_cache = None
+            self._spawn(self._notify_tools_changed())
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._notification_tasks.add(task)
+        task.add_done_callback(self._notification_tasks.discard)
+
+    async def _notify_resource_update(self, uri: str):
+        for callback in self._resource_update_callbacks:
+            try:
+                await callback(uri)
+            except Exception as e:
+                print(f"Error in resource update callback: {e}")
+
+    async def _notify_tools_changed(self):
+        tools = await self.refresh_tools()
+        for callback in self._tools_changed_callbacks:
+            try:
+                await callback(tools)
+            except Exception as e:
+                print(f"Error in tools changed callback: {e}")
 
     async def connect(self):
         """Establishes connection to MCP server"""
-        self._client = stdio_client(self.server_params)
-        self.read, self.write = await self._client.__aenter__()
-        session = ClientSession(self.read, self.write)
+        if isinstance(self.server_params, str):
+            if self.server_params.rstrip('/').endswith('/sse'):
+                self._client = sse_client(self.server_params)
+            else:
+                self._client = streamablehttp_client(self.server_params)
+        else:
+            self._client = stdio_client(self.server_params)
+        streams = await self._client.__aenter__()
+        self.read, self.write = streams[0], streams[1]
+        session = ClientSession(self.read, self.write, message_handler=self._handle_incoming_message)
         self.session = await session.__aenter__()
         await self.session.initialize()
-        
-        # Start message handling task
-        self._notification_task = asyncio.create_task(self._handle_incoming_messages())
 
     # Tools
 
     async def get_available_tools(self) -> List[Any]:
-        """List available tools"""
+        """
+        List available tools. The catalog is fetched once and then only refreshed
+        when the server sends a tools/list_changed notification.
+        """
+        if self._tools_cache is None:
+            return await self.refresh_tools()
+        return self._tools_cache
+
+    async def refresh_tools(self) -> List[Any]:
+        """
+        Fetch the tool catalog from the server, sharing one request between
+        concurrent callers. A request started before the latest tools/list_changed
+        is not shared, as its result may be out of date.
+        """
         if not self.session:
             raise RuntimeError("Not connected to MCP server")
-            
-        response = await self.session.list_tools()
-        print("Raw tools data:", response)  # Debug print
-        
-        # Extract the actual tools from the response
-        tools = response.tools if hasattr(response, 'tools') else []
-        
+        if self._tools_refresh is None or self._tools_refresh_version != self._tools_version:
+            self._tools_refresh_version = self._tools_version
+            self._tools_refresh = asyncio.create_task(self._list_tools(self._tools_version))
+            self._tools_refresh.add_done_callback(self._clear_tools_refresh)
+            # Tracked so that a superseded refresh is still cancelled on exit
+            self._notification_tasks.add(self._tools_refresh)
+            self._tools_refresh.add_done_callback(self._notification_tasks.discard)
+        return await asyncio.shield(self._tools_refresh)
+
+    def _clear_tools_refresh(self, task):
+        if self._tools_refresh is task:
+            self._tools_refresh = None
+
+    async def _list_tools(self, version: int) -> List[Any]:
+        tools = []
+        cursor = None
+        with get_tracer().span('mcp.list_tools'):
+            while True:
+                response = await self.session.list_tools(cursor)
+                tools.extend(response.tools)
+                cursor = response.nextCursor
+                if not cursor:
+                    break
+
         # Convert tools to list of dictionaries with expected attributes
         formatted_tools = [
             {
                 'name': tool.name,
                 'description': str(tool.description) if tool.description is not None else "No description available",
+                'annotations': tool.annotations.model_dump(exclude_none=True) if tool.annotations else {},
                 'inputSchema': {
                     'json': {
                         'type': 'object',
@@ -84,15 +175,23 @@ class MCPClient:
             }
             for tool in tools
         ]
-        print("Formatted tools:", json.dumps(formatted_tools, indent=2))  # Debug print
+        # Not cached if the tools changed while listing them
+        if version == self._tools_version:
+            self._tools_cache = formatted_tools
         return formatted_tools
 
+    def on_tools_changed(self, callback):
+        """Register an async callback(tools) called with the new catalog after tools/list_changed"""
+        self._tools_changed_callbacks.append(callback)
+
     async def call_tool(self, tool_name: str, arguments: dict) -> Any:
         """Call a tool with given arguments"""
         if not self.session:
             raise RuntimeError("Not connected to MCP server")
             
-        result = await self.session.call_tool(tool_name, arguments=arguments)
+        with get_tracer().span('mcp.call_tool', tool=tool_name) as span:
+            result = await self.session.call_tool(tool_name, arguments=arguments)
+            span.set_attribute('is_error', bool(result.isError))
         return result
     
     # Resources
@@ -101,19 +200,98 @@ class MCPClient:
         """List available resources"""
         if not self.session:
             raise RuntimeError("Not connected to MCP server")
-            
-        resources = await self.session.list_resources()
-        _, resources_list = resources
-        _, resources_list = resources_list
-        return resources_list
-    
+
+        resources, cursor = [], None
+        while True:
+            result = await self.session.list_resources(cursor)
+            resources.extend(result.resources)
+            cursor = result.nextCursor
+            if not cursor:
+                return resources
+
     async def get_resource(self, uri: str) -> Any:
-        """Get a resource"""
+        """
+        Get a resource. If the server supports subscriptions, the client subscribes
+        to it and caches it until the server reports an update, so repeated reads
+        cost no round trip. Concurrent reads of the same URI share one request.
+        """
         if not self.session:
             raise RuntimeError("Not connected to MCP server")
-            
-        resource = await self.session.read_resource(uri)
-        return resource
+
+        uri = self._resource_key(uri)
+        if uri in self._resource_cache:
+            self._resource_cache.move_to_end(uri)
+            self._resource_stats['hits'] += 1
+            return self._resource_cache[uri]
+        self._resource_stats['misses'] += 1
+        if uri not in self._resource_reads:
+            task = asyncio.create_task(self._read_resource(uri))
+            self._resource_reads[uri] = task
+            task.add_done_callback(lambda _: self._resource_reads.pop(uri, None))
+        return await asyncio.shield(self._resource_reads[uri])
+
+    async def _read_resource(self, uri: str) -> Any:
+        uri = self._resource_key(uri)
+        with get_tracer().span('mcp.read_resource', uri=uri):
+            version = self._resource_versions.get(uri, 0)
+            subscribed = await self._subscribe(uri)
+            resource = await self.session.read_resource(uri)
+            # An update that arrived during the read may not be reflected in it
+            if subscribed and self._resource_versions.get(uri, 0) == version:
+                self._resource_cache[uri] = resource
+                while len(self._resource_cache) > self.resource_cache_size:
+                    evicted, _ = self._resource_cache.popitem(last=False)
+                    task = asyncio.create_task(self._unsubscribe(evicted))
+                    self._unsubscribes.add(task)
+                    task.add_done_callback(self._unsubscribes.discard)
+            return resource
+
+    async def _subscribe(self, uri: str) -> bool:
+        """
+        Subscribe to updates of a resource, returning whether it can be cached.
+        Servers built on the Python SDK don't advertise the subscribe capability
+        even when they support it, so the first subscribe finds out.
+        """
+        if self.resource_cache_size <= 0 or self._subscriptions_supported is False:
+            return False
+        if uri in self._subscribed:
+            return True
+        try:
+            await self.session.subscribe_resource(uri)
+        except McpError as e:
+            if e.error.code == types.METHOD_NOT_FOUND:
+                self._subscriptions_supported = False
+            else:
+                print(f"Error subscribing to resource {uri}: {e}")
+            return False
+        self._subscriptions_supported = True
+        self._subscribed.add(uri)
+        return True
+
+    async def _unsubscribe(self, uri: str):
+        uri = self._resource_key(uri)
+        self._subscribed.discard(uri)
+        self._resource_versions.pop(uri, None)
+        try:
+            await self.session.unsubscribe_resource(uri)
+        except Exception as e:
+            print(f"Error unsubscribing from resource {uri}: {e}")
+
+    @staticmethod
+    def _resource_key(uri: str) -> str:
+        """
+        The URI as update notifications carry it (e.g. http://example.com becomes
+        http://example.com/), so cached resources are found when invalidating them
+        """
+        return str(AnyUrl(uri))
+
+    def _invalidate_resource(self, uri: str):
+        self._resource_versions[uri] = self._resource_versions.get(uri, 0) + 1
+        self._resource_cache.pop(uri, None)
+
+    def resource_cache_stats(self) -> dict:
+        """Resource cache hit/miss counters and size"""
+        return {**self._resource_stats, 'size': len(self._resource_cache)}
 
     def on_resource_update(self, callback):
         """Register a callback to be called when resources are updated"""
@@ -0,0 +1,246 @@
+from mcp import StdioServerParameters
+from mcp.shared.exceptions import McpError
+from mcp_client import MCPClient
+from typing import Any, Dict, List, Optional, Union
+import asyncio
+
+class MCPServerReplica:
+    """
+    One connection to an MCP server. The connection is opened and closed by a
+    dedicated task, as the MCP transports require.
+    """
+    def __init__(self, server_name: str, index: int, server_params: Union[StdioServerParameters, str]):
+        self.server_name = server_name
+        self.index = index
+        self.server_params = server_params
+        self.client: Optional[MCPClient] = None
+        self.in_flight = 0  # tool calls currently running on this replica
+        self.error: Optional[BaseException] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.client is not None and not self._stop.is_set()
+
+    async def start(self, on_connect=None):
+        """Connect to the server, raising if the connection fails"""
+        self._ready.clear()
+        self._stop.clear()
+        self.error = None
+        self._task = asyncio.create_task(self._run(on_connect))
+        await self._ready.wait()
+        if self.error:
+            raise self.error
+
+    async def _run(self, on_connect):
+        try:
+            async with MCPClient(self.server_params) as client:
+                if on_connect:
+                    on_connect(client)
+                self.client = client
+                self._ready.set()
+                await self._stop.wait()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.client = None
+            self._ready.set()
+
+    def mark_failed(self):
+        """
+        Take the replica out of rotation right away. Its connection task then
+        closes the connection, and the supervisor restarts it.
+        """
+        self._stop.set()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def wait_closed(self):
+        """Wait until the connection task ends, i.e. the replica was stopped or crashed"""
+        if self._task:
+            await asyncio.shield(self._task)
+
+class MCPClientManager:
+    """
+    Starts and supervises several MCP servers, stdio or HTTP, merges their tool
+    catalogs and routes each tool call to a server that provides the tool.
+
+    A server can run as several replicas (separate processes or connections).
+    Calls go to the healthy replica with the fewest calls in flight, and
+    replicas that fail are restarted in the background.
+    """
+    def __init__(self, restart_delay: float = 1.0):
+        self.restart_delay = restart_delay
+        self._replicas: Dict[str, List[MCPServerReplica]] = {}
+        self._routes: Dict[str, tuple] = {}  # exposed tool name -> (server name, tool name)
+        self._tools: List[Dict] = []
+        self._resource_update_callbacks = []
+        self._tools_changed_callbacks = []
+        self._supervisors = []
+        self._closing = False
+
+    def add_server(self, name: str, server_params: Union[StdioServerParameters, str], replicas: int = 1):
+        """Add a server to start; CPU heavy stdio servers benefit from several replicas"""
+        self._replicas[name] = [
+            MCPServerReplica(name, index, server_params) for index in range(max(1, replicas))
+        ]
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def start(self):
+        """Start every replica of every server concurrently and build the tool catalog"""
+        replicas = [replica for server in self._replicas.values() for replica in server]
+        results = await asyncio.gather(
+            *(replica.start(self._on_connect) for replica in replicas),
+            return_exceptions=True
+        )
+        for replica, result in zip(replicas, results):
+            if isinstance(result, BaseException):
+                print(f"Failed to start MCP server {replica.server_name}[{replica.index}]: {result}")
+        for replica in replicas:
+            self._supervisors.append(asyncio.create_task(self._supervise(replica)))
+        await self.refresh_tools()
+
+    async def stop(self):
+        self._closing = True
+        for supervisor in self._supervisors:
+            supervisor.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        self._supervisors = []
+        await asyncio.gather(
+            *(replica.stop() for server in self._replicas.values() for replica in server),
+            return_exceptions=True
+        )
+
+    def _on_connect(self, client: MCPClient):
+        for callback in self._resource_update_callbacks:
+            client.on_resource_update(callback)
+        client.on_tools_changed(self._on_server_tools_changed)
+
+    async def _on_server_tools_changed(self, tools: List[Dict]):
+        merged = await self.refresh_tools()
+        for callback in self._tools_changed_callbacks:
+            try:
+                await callback(merged)
+            except Exception as e:
+                print(f"Error in tools changed callback: {e}")
+
+    def on_tools_changed(self, callback):
+        """Register an async callback(tools) called with the merged catalog when a server's tools change"""
+        self._tools_changed_callbacks.append(callback)
+
+    async def _supervise(self, replica: MCPServerReplica):
+        """Restart a replica whenever its connection ends unexpectedly"""
+        while not self._closing:
+            await replica.wait_closed()
+            if self._closing:
+                return
+            print(f"MCP server {replica.server_name}[{replica.index}] is down, restarting")
+            await asyncio.sleep(self.restart_delay)
+            try:
+                await replica.start(self._on_connect)
+            except Exception as e:
+                print(f"Failed to restart MCP server {replica.server_name}[{replica.index}]: {e}")
+
+    # Tools
+
+    async def refresh_tools(self) -> List[Dict]:
+        """List the tools of every server concurrently and merge them into one catalog"""
+        server_names = list(self._replicas)
+        catalogs = await asyncio.gather(
+            *(self._list_server_tools(name) for name in server_names),
+            return_exceptions=True
+        )
+        providers: Dict[str, List[str]] = {}
+        for server_name, catalog in zip(server_names, catalogs):
+            if isinstance(catalog, BaseException):
+                print(f"Failed to list tools of MCP server {server_name}: {catalog}")
+                continue
+            for tool in catalog:
+                providers.setdefault(tool['name'], []).append(server_name)
+
+        tools, routes = [], {}
+        for server_name, catalog in zip(server_names, catalogs):
+            if isinstance(catalog, BaseException):
+                continue
+            for tool in catalog:
+                # Tool names offered by several servers are prefixed with the server name
+                exposed_name = tool['name'] if len(providers[tool['name']]) == 1 else f"{server_name}_{tool['name']}"
+                routes[exposed_name] = (server_name, tool['name'])
+                tools.append({**tool, 'name': exposed_name, 'server': server_name})
+        self._tools, self._routes = tools, routes
+        return tools
+
+    async def _list_server_tools(self, server_name: str) -> List[Dict]:
+        replica = self._pick_replica(server_name)
+        return await replica.client.get_available_tools()
+
+    async def get_available_tools(self) -> List[Dict]:
+        """
+        The merged tool catalog, in the MCPClient.get_available_tools format plus the
+        server name. It is rebuilt when a server reports a change to its tools.
+        """
+        return self._tools
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> Any:
+        """Call a tool on the least loaded healthy replica of the server that provides it"""
+        if tool_name not in self._routes:
+            raise ValueError(f"Unknown tool: {tool_name}")
+        server_name, server_tool_name = self._routes[tool_name]
+        tried = set()
+        while True:
+            replica = self._pick_replica(server_name, exclude=tried)
+            tried.add(replica)
+            replica.in_flight += 1
+            try:
+                return await replica.client.call_tool(server_tool_name, arguments)
+            except McpError:
+                # The server answered with a protocol error; the connection is fine
+                raise
+            except Exception:
+                # Transport failure: restart the replica and retry on another one
+                replica.mark_failed()
+                if not self._pick_replica_or_none(server_name, exclude=tried):
+                    raise
+            finally:
+                replica.in_flight -= 1
+
+    def _pick_replica(self, server_name: str, exclude=()) -> MCPServerReplica:
+        replica = self._pick_replica_or_none(server_name, exclude)
+        if replica is None:
+            raise RuntimeError(f"No healthy replica of MCP server {server_name}")
+        return replica
+
+    def _pick_replica_or_none(self, server_name: str, exclude=()) -> Optional[MCPServerReplica]:
+        healthy = [
+            replica for replica in self._replicas[server_name]
+            if replica.healthy and replica not in exclude
+        ]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda replica: replica.in_flight)
+
+    def get_client(self, server_name: str) -> MCPClient:
+        """A connected client of the given server, e.g. for resource access"""
+        return self._pick_replica(server_name).client
+
+    # Resources
+
+    def on_resource_update(self, callback):
+        """Register a callback to be called when a resource of any server is updated"""
+        self._resource_update_callbacks.append(callback)
+        for server in self._replicas.values():
+            for replica in server:
+                if replica.client:
+                    replica.client.on_resource_update(callback)
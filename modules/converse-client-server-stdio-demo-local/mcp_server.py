@@ -1,26 +1,114 @@
 from mcp.server.fastmcp import FastMCP
-from typing import Dict, Any
+from mcp.types import ToolAnnotations
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, List, Optional
+import atexit
+import bisect
+import functools
+import itertools
+import json
 import logging
+import math
+import operator
+import os
+import queue
+import statistics
 import sys
+import threading
+import time
 
-# Configure logging to write to both file and stderr
+# Log through a queue: tool calls only enqueue records, and a background thread
+# formats them and writes them to the file and stderr.
+# Set MCP_SERVER_LOG_LEVEL=DEBUG to log every tool call and result.
+log_queue = queue.SimpleQueue()
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler = logging.FileHandler('mcp_server.log')
+file_handler.setFormatter(formatter)
+stderr_handler = logging.StreamHandler(sys.stderr)
+stderr_handler.setFormatter(formatter)
+log_listener = QueueListener(log_queue, file_handler, stderr_handler, respect_handler_level=True)
+queue_handler = QueueHandler(log_queue)
+# Only merge the message arguments here; the listener's handlers add timestamp and level
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('mcp_server.log'),
-        logging.StreamHandler(sys.stderr)
-    ]
+    level=os.getenv('MCP_SERVER_LOG_LEVEL', 'INFO').upper(),
+    handlers=[queue_handler]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Create a FastMCP instance
 mcp = FastMCP("Demo Server")
 
-@mcp.tool()
+class ToolMetrics:
+    """Per-tool call counts, errors and latency histograms, kept in memory"""
+    # Histogram bucket upper bounds, in milliseconds
+    BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def record(self, tool_name: str, seconds: float, error: bool = False):
+        milliseconds = seconds * 1000
+        with self._lock:
+            stats = self._tools.get(tool_name)
+            if stats is None:
+                stats = self._tools[tool_name] = {
+                    'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'buckets': [0] * (len(self.BUCKETS_MS) + 1)
+                }
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['total_ms'] += milliseconds
+            stats['max_ms'] = max(stats['max_ms'], milliseconds)
+            stats['buckets'][bisect.bisect_left(self.BUCKETS_MS, milliseconds)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                tool_name: {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'mean_ms': round(stats['total_ms'] / stats['calls'], 3),
+                    'max_ms': round(stats['max_ms'], 3),
+                    # Cumulative count of calls at or below each bound, Prometheus style
+                    'histogram_ms': {
+                        f"le_{bound:g}": count
+                        for bound, count in zip(self.BUCKETS_MS + (math.inf,), itertools.accumulate(stats['buckets']))
+                    }
+                }
+                for tool_name, stats in self._tools.items()
+            }
+
+metrics = ToolMetrics()
+
+def instrumented(func):
+    """Record the call count and latency of a tool; keeps the signature FastMCP reads the schema from"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            metrics.record(func.__name__, time.perf_counter() - started, error)
+    return wrapper
+
+@mcp.resource("metrics://tools", mime_type="application/json")
+def tool_metrics() -> str:
+    """Call counts, errors and latency histograms of each tool since the server started"""
+    return json.dumps(metrics.snapshot())
+
+# Pure function: clients may cache its results
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True, openWorldHint=False))
+@instrumented
 def calculator(operation: str, x: float, y: float) -> Dict[str, Any]:
     """A simple calculator that can add, subtract, multiply, and divide"""
-    logger.info(f"Calculator called with operation={operation}, x={x}, y={y}")
+    logger.debug("Calculator called with operation=%s, x=%s, y=%s", operation, x, y)
     
     result = None
     if operation == "add":
@@ -35,13 +123,118 @@ def calculator(operation: str, x: float, y: float) -> Dict[str, Any]:
             raise ValueError("Cannot divide by zero")
         result = x / y
     
-    logger.info(f"Calculator result: {result}")
+    logger.debug("Calculator result: %s", result)
     return {"result": result}
 
+BATCH_OPERATIONS = {
+    "add": operator.add,
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+    "power": operator.pow,
+    "modulo": operator.mod,
+    "min": min,
+    "max": max,
+}
+
+MAX_BATCH_SIZE = 10000
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True, openWorldHint=False))
+@instrumented
+def batch_calculator(operations: List[str], x: List[float], y: List[float]) -> Dict[str, Any]:
+    """
+    Calculate many rows in one call: results[i] = operations[i](x[i], y[i]).
+    Pass a single operation to apply it to every row. Operations: add, subtract,
+    multiply, divide, power, modulo, min, max. A row that fails (e.g. division
+    by zero) gets a null result and an entry in errors; the other rows still compute.
+    """
+    logger.debug("Batch calculator called with %d rows", len(x))
+    if len(x) != len(y):
+        raise ValueError(f"x and y must have the same length ({len(x)} != {len(y)})")
+    if len(operations) not in (1, len(x)):
+        raise ValueError("operations must have one entry, or one per row")
+    if len(x) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} rows per call")
+    unknown = set(operations) - set(BATCH_OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations: {sorted(unknown)}")
+
+    functions = [BATCH_OPERATIONS[operation] for operation in operations]
+    if len(functions) == 1:
+        functions = functions * len(x)
+    results = []
+    errors = {}
+    for row, (function, a, b) in enumerate(zip(functions, x, y)):
+        try:
+            value = function(a, b)
+            if isinstance(value, complex):
+                raise ValueError("Result is a complex number")
+            results.append(value)
+        except (ArithmeticError, ValueError) as e:
+            results.append(None)
+            errors[row] = str(e)
+
+    logger.debug("Batch calculator computed %d rows, %d errors", len(results), len(errors))
+    return {"results": results, "errors": errors}
+
+AGGREGATES = {
+    "count": len,
+    "sum": math.fsum,
+    "mean": statistics.fmean,
+    "median": statistics.median,
+    "min": min,
+    "max": max,
+    "stdev": statistics.stdev,
+    "variance": statistics.variance,
+}
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Percentile of sorted values with linear interpolation between ranks"""
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True, openWorldHint=False))
+@instrumented
+def aggregate(values: List[float], aggregates: Optional[List[str]] = None,
+              percentiles: Optional[List[float]] = None) -> Dict[str, Any]:
+    """
+    Summarize a list of numbers in one call. aggregates: any of count, sum, mean,
+    median, min, max, stdev, variance (default: count, sum, mean, min, max).
+    percentiles: e.g. [50, 90, 99], returned as p50, p90, p99.
+    """
+    logger.debug("Aggregate called with %d values", len(values))
+    if not values:
+        raise ValueError("values must not be empty")
+    if len(values) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} values per call")
+    aggregates = aggregates or ["count", "sum", "mean", "min", "max"]
+    unknown = set(aggregates) - set(AGGREGATES)
+    if unknown:
+        raise ValueError(f"Unknown aggregates: {sorted(unknown)}")
+
+    result = {}
+    for name in aggregates:
+        try:
+            result[name] = AGGREGATES[name](values)
+        except statistics.StatisticsError as e:
+            # e.g. stdev of a single value
+            result[name] = None
+            logger.warning("Aggregate %s failed: %s", name, e)
+    if percentiles:
+        ordered = sorted(values)
+        for pct in percentiles:
+            if not 0 <= pct <= 100:
+                raise ValueError(f"Percentile must be between 0 and 100: {pct}")
+            result[f"p{pct:g}"] = percentile(ordered, pct)
+    return result
+
 @mcp.tool()
+@instrumented
 def weather(location: str) -> Dict[str, Any]:
     """Get the current weather for a location"""
-    logger.info(f"Weather tool called for location: {location}")
+    logger.debug("Weather tool called for location: %s", location)
     
     # This is a mock implementation
     response = {
@@ -49,7 +242,7 @@ def weather(location: str) -> Dict[str, Any]:
         "condition": "sunny",
         "location": location
     }
-    logger.info(f"Weather response: {response}")
+    logger.debug("Weather response: %s", response)
     return response
 
 if __name__ == "__main__":
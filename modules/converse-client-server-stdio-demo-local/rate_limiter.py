@@ -0,0 +1,252 @@
+"""
+Client-side rate limiting for Bedrock calls shared by many agents.
+
+Each model ID gets request- and token-per-minute buckets and an adaptive
+concurrency limit. The limit grows by one slot per round of successful calls
+and halves when Bedrock throttles (AIMD), so throughput settles near the
+account quota instead of thrashing on retries:
+
+    limiter = BedrockRateLimiter(requests_per_minute=200, tokens_per_minute=400000)
+    for agent in agents:
+        agent.rate_limiter = limiter
+"""
+from botocore.exceptions import ClientError
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import random
+import time
+from tracing import current_span
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException')
+
+def is_throttling_error(error: BaseException) -> bool:
+    """Whether an exception is Bedrock telling the caller to slow down"""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+    # Errors reported inside a ConverseStream response
+    return 'throttlingException' in str(error) or 'serviceUnavailableException' in str(error)
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """
+    Rough token count of a converse request: ~4 characters per input token plus
+    the output budget, which Bedrock reserves against the quota up front
+    """
+    text = json.dumps(
+        [request.get('system'), request.get('messages'), request.get('toolConfig')],
+        default=str
+    )
+    max_tokens = request.get('inferenceConfig', {}).get('maxTokens', 0)
+    return len(text) // 4 + max_tokens
+
+class TokenBucket:
+    """
+    Allows `per_minute` units per minute, refilled continuously. Waiters are
+    served in arrival order. The balance can go negative when actual usage
+    turns out higher than estimated; later callers then wait for the debt.
+    """
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float):
+        # A request larger than the bucket can never fit; let it through on a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) * 60 / self.per_minute)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, amount: float):
+        """Take (positive) or return (negative) units after the fact"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+class AdaptiveConcurrencyLimit:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease:
+    +1 after `limit` successful calls, halved on throttling. A burst of throttles
+    is one congestion event: throttled calls that started before the last
+    decrease don't decrease the limit again.
+    """
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, backoff_ratio: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = float('-inf')  # time.monotonic() of the last decrease
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before cancellation; pass it on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_throttle(self, started: Optional[float] = None):
+        """Halve the limit after a throttled call that started at time.monotonic() `started`"""
+        if started is not None and started < self._last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+        self._last_decrease = time.monotonic()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+class ModelRateLimiter:
+    """Request, token and concurrency limits of a single model ID"""
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+                 concurrency: AdaptiveConcurrencyLimit):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency
+        self.queued = 0  # calls waiting for any of the limits
+        self.calls = 0
+        self.throttles = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queued,
+            'in_flight': self.concurrency.in_flight,
+            'concurrency_limit': int(self.concurrency.limit),
+            'calls': self.calls,
+            'throttles': self.throttles,
+            'requests_available': int(self.requests.available) if self.requests else None,
+            'tokens_available': int(self.tokens.available) if self.tokens else None
+        }
+
+class BedrockRateLimiter:
+    """
+    Shared limiter for Bedrock calls, keyed by model ID. Throttled calls are
+    retried with exponential backoff and jitter after shrinking the
+    concurrency limit. For the limiter to see throttling, create the Bedrock
+    client with few SDK retries, e.g. create_bedrock_client(region, max_attempts=1).
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 initial_concurrency: int = 4, max_concurrency: int = 16, max_retries: int = 6,
+                 base_delay: float = 0.5, max_delay: float = 20.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._models: Dict[str, ModelRateLimiter] = {}
+
+    def configure(self, model_id: str, requests_per_minute: Optional[float] = None,
+                  tokens_per_minute: Optional[float] = None, max_concurrency: Optional[int] = None):
+        """Set limits for one model, e.g. one with a different quota than the defaults"""
+        concurrency = AdaptiveConcurrencyLimit(
+            min(self.initial_concurrency, max_concurrency or self.max_concurrency),
+            maximum=max_concurrency or self.max_concurrency
+        )
+        self._models[model_id] = ModelRateLimiter(requests_per_minute, tokens_per_minute, concurrency)
+
+    def _model(self, model_id: str) -> ModelRateLimiter:
+        if model_id not in self._models:
+            self.configure(model_id, self.requests_per_minute, self.tokens_per_minute)
+        return self._models[model_id]
+
+    async def call(self, model_id: str, estimated_tokens: int, func: Callable[[], Awaitable[Dict]],
+                   can_retry: Optional[Callable[[], bool]] = None, max_retries: Optional[int] = None) -> Dict:
+        """
+        Run func (a coroutine function making one Bedrock call) within the model's
+        limits, retrying when throttled. can_retry, if given, is asked before each
+        retry, e.g. to not repeat a stream whose output was already passed on.
+        max_retries overrides the limiter's; with 0 throttling is raised right
+        away (after shrinking the concurrency limit), e.g. for another endpoint to take over.
+        The token estimate is corrected with the response's usage.totalTokens.
+        """
+        model = self._model(model_id)
+        if max_retries is None:
+            max_retries = self.max_retries
+        for attempt in range(max_retries + 1):
+            started = time.perf_counter()
+            model.queued += 1
+            try:
+                if model.requests:
+                    await model.requests.acquire(1)
+                if model.tokens:
+                    await model.tokens.acquire(estimated_tokens)
+                await model.concurrency.acquire()
+            finally:
+                model.queued -= 1
+            current_span().set_attribute('rate_limit_wait_ms', round((time.perf_counter() - started) * 1000, 1))
+
+            model.calls += 1
+            call_started = time.monotonic()
+            try:
+                try:
+                    response = await func()
+                finally:
+                    # Also when cancelled (timeouts, lost hedges), or the slot would leak
+                    model.concurrency.release()
+            except Exception as e:
+                if not is_throttling_error(e):
+                    raise
+                model.throttles += 1
+                model.concurrency.on_throttle(call_started)
+                current_span().set_attribute('throttle_retries', attempt + 1)
+                if attempt == max_retries or (can_retry and not can_retry()):
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                continue
+
+            model.concurrency.on_success()
+            if model.tokens:
+                actual_tokens = response.get('usage', {}).get('totalTokens')
+                if actual_tokens is not None:
+                    model.tokens.adjust(actual_tokens - min(estimated_tokens, model.tokens.capacity))
+            return response
+
+    def stats(self, model_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue depth, concurrency and throttling counters of one model, or all models"""
+        if model_id is not None:
+            return self._model(model_id).stats()
+        return {model_id: model.stats() for model_id, model in self._models.items()}
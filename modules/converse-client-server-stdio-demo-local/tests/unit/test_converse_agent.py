@@ -0,0 +1,76 @@
+import asyncio
+
+from converse_agent import ConverseAgent
+from converse_tools import ConverseToolManager
+
+# Each turn of the scripted conversation: (text, whether the turn calls a tool)
+SCRIPT = [("Let me check.", True), ("The answer is 4.", False)]
+
+
+class ScriptedClient:
+    """Plays SCRIPT through converse or converse_stream, based on the tool rounds so far"""
+    def _turn(self, messages):
+        rounds = sum(
+            1 for message in messages
+            if message['role'] == 'user' and any('toolResult' in block for block in message['content'])
+        )
+        return SCRIPT[rounds]
+
+    def converse(self, messages, **kwargs):
+        text, calls_tool = self._turn(messages)
+        content = [{'text': text}]
+        if calls_tool:
+            content.append({'toolUse': {'toolUseId': 't1', 'name': 'add', 'input': {'x': 2, 'y': 2}}})
+        return {
+            'output': {'message': {'role': 'assistant', 'content': content}},
+            'stopReason': 'tool_use' if calls_tool else 'end_turn',
+            'usage': {'inputTokens': 10, 'outputTokens': 5, 'totalTokens': 15},
+        }
+
+    def converse_stream(self, messages, **kwargs):
+        text, calls_tool = self._turn(messages)
+        events = [{'messageStart': {'role': 'assistant'}}]
+        # Stream the text in two deltas, as Bedrock would in many
+        for part in (text[:4], text[4:]):
+            events.append({'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': part}}})
+        if calls_tool:
+            events += [
+                {'contentBlockStart': {'contentBlockIndex': 1, 'start': {
+                    'toolUse': {'toolUseId': 't1', 'name': 'add'}}}},
+                {'contentBlockDelta': {'contentBlockIndex': 1, 'delta': {
+                    'toolUse': {'input': '{"x": 2, "y": 2}'}}}},
+            ]
+        events += [
+            {'messageStop': {'stopReason': 'tool_use' if calls_tool else 'end_turn'}},
+            {'metadata': {'usage': {'inputTokens': 10, 'outputTokens': 5, 'totalTokens': 15}}},
+        ]
+        return {'stream': events}
+
+
+async def add(name, arguments):
+    return arguments['x'] + arguments['y']
+
+
+def make_agent():
+    tools = ConverseToolManager()
+    tools.register_tool(
+        name='add',
+        func=add,
+        description='Add two numbers',
+        input_schema={'json': {'type': 'object', 'properties': {
+            'x': {'type': 'number'}, 'y': {'type': 'number'}}}},
+    )
+    agent = ConverseAgent('test-model', client=ScriptedClient())
+    agent.tools = tools
+    return agent
+
+
+def test_streamed_and_returned_text_match_across_tool_turns():
+    async def run():
+        answer = await make_agent().invoke_with_prompt('What is 2 plus 2?')
+        streamed = [delta async for delta in make_agent().invoke_stream('What is 2 plus 2?')]
+        return answer, ''.join(streamed)
+
+    answer, streamed = asyncio.run(run())
+    assert answer == "Let me check.\n\nThe answer is 4."
+    assert streamed == answer
@@ -0,0 +1,58 @@
+import asyncio
+
+from converse_history import ConverseHistoryManager
+
+# A system prompt and tool specs of about 4000 tokens, which Bedrock counts
+# as input of every call but which are not part of the messages
+REQUEST_OVERHEAD_TOKENS = 4000
+
+
+def message_tokens(text):
+    return len(text) // 4
+
+
+def test_request_overhead_is_not_counted_per_message_character():
+    history = ConverseHistoryManager(max_tokens=50000)
+    question = "What is the weather in Brisbane?"
+    messages = [
+        {"role": "user", "content": [{"text": question}]},
+        {"role": "assistant", "content": [
+            {"text": "Let me check."},
+            {"toolUse": {"toolUseId": "t1", "name": "weather", "input": {"city": "Brisbane"}}},
+        ]},
+    ]
+    history.record_usage(messages, {
+        "inputTokens": REQUEST_OVERHEAD_TOKENS + message_tokens(question),
+        "outputTokens": 40,
+    })
+
+    tool_output = "x" * 20000
+    messages.append({"role": "user", "content": [
+        {"toolResult": {"toolUseId": "t1", "content": [{"text": tool_output}]}},
+    ]})
+    assert history.estimate_tokens(messages) < 12000
+
+    compacted = asyncio.run(history.compact(messages))
+    assert compacted is messages
+    assert compacted[-1]["content"][0]["toolResult"]["content"][0]["text"] == tool_output
+
+
+def test_tokens_per_char_is_calibrated_on_added_messages():
+    history = ConverseHistoryManager(max_tokens=50000)
+    messages = [
+        {"role": "user", "content": [{"text": "Summarize the report."}]},
+        {"role": "assistant", "content": [
+            {"toolUse": {"toolUseId": "t1", "name": "read_report", "input": {}}},
+        ]},
+    ]
+    history.record_usage(messages, {"inputTokens": REQUEST_OVERHEAD_TOKENS + 10, "outputTokens": 20})
+
+    messages.append({"role": "user", "content": [
+        {"toolResult": {"toolUseId": "t1", "content": [{"text": "y" * 10000}]}},
+    ]})
+    messages.append({"role": "assistant", "content": [{"text": "It is about tokens."}]})
+    # The added messages take 3000 tokens: about 0.3 per character
+    history.record_usage(messages, {"inputTokens": REQUEST_OVERHEAD_TOKENS + 3030, "outputTokens": 10})
+
+    added = [{"role": "user", "content": [{"text": "z" * 10000}]}]
+    assert 2900 <= history.estimate_tokens(messages + added) - (REQUEST_OVERHEAD_TOKENS + 3040) <= 3200
@@ -0,0 +1,61 @@
+import asyncio
+import copy
+import pickle
+
+from converse_tools import READ_TOOL_RESULT, ConverseToolManager
+
+
+def tool_names(manager):
+    return [tool['toolSpec']['name'] for tool in manager.get_tools()['tools']]
+
+
+def test_read_tool_result_is_offered_before_any_result_overflows():
+    manager = ConverseToolManager(max_result_chars=100)
+    assert tool_names(manager) == [READ_TOOL_RESULT]
+    manager.clear_tools()
+    assert tool_names(manager) == [READ_TOOL_RESULT]
+    assert tool_names(ConverseToolManager(max_result_chars=None)) == []
+
+
+def test_cached_preview_keeps_its_full_result_readable():
+    manager = ConverseToolManager(max_result_chars=100, spill_size=2)
+
+    async def report(name, tool_input):
+        return f"{tool_input['id']}:" + "x" * 500
+
+    manager.register_tool('report', report, 'A long report', {'type': 'object'}, cacheable=True)
+    manager.register_tool('big', report, 'Another long report', {'type': 'object'})
+
+    async def call(name, tool_input):
+        return await manager.execute_tool({'toolUseId': 't', 'name': name, 'input': tool_input})
+
+    async def run():
+        cached = await call('report', {'id': 'cached'})
+        # More truncated results than spill_size, from a tool that isn't cached
+        for index in range(5):
+            await call('big', {'id': index})
+        again = await call('report', {'id': 'cached'})
+        assert again['content'] == cached['content']
+        result_id = cached['content'][0]['text'].split('result_id "')[1].split('"')[0]
+        return await call(READ_TOOL_RESULT, {'result_id': result_id, 'offset': 0, 'length': 10})
+
+    page = asyncio.run(run())
+    assert page['status'] == 'success'
+    assert page['content'][0]['text'].startswith('cached:')
+
+
+def test_tool_spec_copies_are_mutable():
+    manager = ConverseToolManager(max_result_chars=None)
+    manager.register_tool('add', None, 'Add two numbers', {'type': 'object'})
+    spec = manager.get_tools()['tools'][0]
+
+    shallow = copy.copy(spec)
+    shallow['extra'] = True
+    tools = copy.copy(manager.get_tools()['tools'])
+    tools.append({'cachePoint': {'type': 'default'}})
+    deep = copy.deepcopy(spec)
+    deep['toolSpec']['name'] = 'renamed'
+
+    assert 'extra' not in spec and len(manager.get_tools()['tools']) == 1
+    assert spec['toolSpec']['name'] == 'add'
+    assert pickle.loads(pickle.dumps(spec)) == spec
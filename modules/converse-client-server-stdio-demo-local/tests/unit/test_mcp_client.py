@@ -0,0 +1,44 @@
+import asyncio
+
+from mcp import types
+
+from mcp_client import MCPClient
+
+
+class StubSession:
+    """Answers resource reads with a new version each time"""
+    def __init__(self):
+        self.reads = 0
+
+    async def subscribe_resource(self, uri):
+        pass
+
+    async def unsubscribe_resource(self, uri):
+        pass
+
+    async def read_resource(self, uri):
+        self.reads += 1
+        return f"version {self.reads}"
+
+
+def resource_updated(uri):
+    return types.ServerNotification(types.ResourceUpdatedNotification(
+        method="notifications/resources/updated",
+        params=types.ResourceUpdatedNotificationParams(uri=uri),
+    ))
+
+
+def test_update_of_normalized_uri_invalidates_cached_resource():
+    async def run():
+        client = MCPClient("http://localhost:8000/mcp")
+        client.session = StubSession()
+        for uri, notified_uri in [("http://example.com", "http://example.com/"),
+                                  ("file:///notes/a b.txt", "file:///notes/a%20b.txt")]:
+            first = await client.get_resource(uri)
+            assert await client.get_resource(uri) == first
+            await client._handle_incoming_message(resource_updated(notified_uri))
+            assert await client.get_resource(uri) != first
+        await asyncio.gather(*client._notification_tasks)
+        return client.session.reads
+
+    assert asyncio.run(run()) == 4
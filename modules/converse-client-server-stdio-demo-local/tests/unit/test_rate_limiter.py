@@ -0,0 +1,28 @@
+import asyncio
+
+from rate_limiter import BedrockRateLimiter
+
+MODEL_ID = "test-model"
+
+
+def test_cancelled_call_releases_its_slot():
+    limiter = BedrockRateLimiter(initial_concurrency=2, max_concurrency=2)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def respond():
+        return {"usage": {"totalTokens": 10}}
+
+    async def run():
+        for _ in range(2):
+            with_timeout = asyncio.wait_for(limiter.call(MODEL_ID, 10, hang), 0.01)
+            try:
+                await with_timeout
+            except asyncio.TimeoutError:
+                pass
+        assert limiter.stats(MODEL_ID)["in_flight"] == 0
+        # Blocks forever if the cancelled calls kept their slots
+        return await asyncio.wait_for(limiter.call(MODEL_ID, 10, respond), 1)
+
+    assert asyncio.run(run()) == {"usage": {"totalTokens": 10}}
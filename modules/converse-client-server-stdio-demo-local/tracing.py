@@ -0,0 +1,164 @@
+"""
+Lightweight tracing for the Converse agent loop.
+
+Spans are recorded for each model call, tool call and MCP round trip, with
+durations and token usage. Nothing is recorded until an exporter is set up:
+
+    from tracing import JsonlSpanExporter, Tracer, set_tracer
+    set_tracer(Tracer([JsonlSpanExporter('traces.jsonl')]))
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import contextvars
+import json
+import os
+import threading
+import time
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """A timed operation. Child spans are linked to the span active when they start."""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_time', 'duration',
+                 'attributes', 'status', '_started')
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, attributes: Optional[Dict] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_time = time.time()
+        self.duration = None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+class _NoopSpan:
+    """Returned when tracing is disabled, so instrumented code costs next to nothing"""
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    def __init__(self, exporters: Optional[List[Any]] = None):
+        self.exporters = list(exporters or [])
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record the enclosed block as a span; exceptions mark it as an error"""
+        if not self.exporters:
+            yield NOOP_SPAN
+            return
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        for exporter in self.exporters:
+            exporter.on_start(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.set_attribute('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            for exporter in self.exporters:
+                exporter.on_end(span)
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+class JsonlSpanExporter:
+    """Appends finished spans to a JSON Lines file, one span per line"""
+    def __init__(self, path: str):
+        self._file = open(path, 'a', buffering=64 * 1024)
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span):
+        pass
+
+    def on_end(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+class OpenTelemetrySpanExporter:
+    """
+    Mirrors spans into OpenTelemetry, so any OTel exporter (OTLP, console, ...)
+    can be used. Requires the optional opentelemetry-sdk package and a
+    configured tracer provider.
+    """
+    def __init__(self, tracer_provider=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetrySpanExporter requires: pip install opentelemetry-sdk")
+        self._trace = trace
+        provider = tracer_provider or trace.get_tracer_provider()
+        self._tracer = provider.get_tracer('converse-agent')
+        self._otel_spans = {}  # span_id -> OTel span, while the span is open
+
+    def on_start(self, span: Span):
+        parent = self._otel_spans.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent else None
+        self._otel_spans[span.span_id] = self._tracer.start_span(
+            span.name, context=context, start_time=int(span.start_time * 1e9)
+        )
+
+    def on_end(self, span: Span):
+        otel_span = self._otel_spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        if span.status == 'error':
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+    def shutdown(self):
+        self._otel_spans.clear()
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    """The process-wide tracer used by the agent, tool manager and MCP client"""
+    return _tracer
+
+def current_span():
+    """The span active in the current task, or a no-op span"""
+    return _current_span.get() or NOOP_SPAN
+
+def set_tracer(tracer: Tracer):
+    global _tracer
+    _tracer = tracer